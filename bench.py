@@ -0,0 +1,216 @@
+
+import gc, json, math, os, platform, shutil, subprocess, sys, tempfile, time, tracemalloc
+
+# Usage: python3 bench.py [--quick] [--json FILE] [--repeat N]
+#   --quick   small sizes and one repeat, for a smoke run
+#   --json    also write the results as JSON to FILE ('-' for stdout), so
+#             that runs of different versions can be diffed
+#   If GRAMMARS is set, will look for grammars there, otherwise in the
+#   directory of this file
+
+import parser
+
+gdir = os.getenv('GRAMMARS') or os.path.dirname(os.path.abspath(__file__))
+fg1 = os.path.join(gdir, 'fg1')
+
+
+#--  Synthetic sentences  ------------------------------------------------------
+
+# Both families have Catalan-many parses in fg1.g: conjoined clauses through
+# S.- -> S.- Conj.* S.-, and PPs attached to any N2 to their left through
+# N2.$n -> N2.$n PP.loc.
+
+def coordination(n):
+    return ' and '.join(['Jack kills Tuna'] * n).split()
+
+def pp_attachment(n):
+    return ('Jack loves the dog' + ' behind the dog' * n).split()
+
+FAMILIES = {'coordination': coordination, 'pp_attachment': pp_attachment}
+
+
+#--  Measurement  --------------------------------------------------------------
+
+def percentile(values, p):
+    # nearest rank
+    values = sorted(values)
+    if not values:
+        return None
+    k = max(0, min(len(values) - 1, math.ceil(p / 100.0 * len(values)) - 1))
+    return values[k]
+
+def latency_summary(times):
+    return {'mean': sum(times) / len(times),
+            'p50': percentile(times, 50),
+            'p90': percentile(times, 90),
+            'p99': percentile(times, 99),
+            'max': max(times)}
+
+def timed(f, *args):
+    start = time.perf_counter()
+    value = f(*args)
+    return (time.perf_counter() - start, value)
+
+def chart_size(chart):
+    # edges counts partly matched rules: Edges for the agenda engine, and
+    # the child sequences matched by Splits for CKY
+    if isinstance(chart, parser.CKYChart):
+        edges = sum(map(len, chart.partials.values()))
+    else:
+        edges = sum(map(len, chart.edges.map.values()))
+    return {'nodes': len(chart.chart), 'edges': edges}
+
+def bench_load(repeat):
+    results = {}
+    results['read'] = min(timed(parser.Grammar, fg1)[0] for _ in range(repeat))
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache = os.path.join(tmpdir, 'fg1.gcache')
+        results['cache_write'] = timed(parser.Grammar, fg1, cache)[0]
+        results['cache_read'] = min(timed(parser.Grammar, fg1, cache)[0]
+                                    for _ in range(repeat))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    g = parser.Grammar(fg1)
+    results['compile'] = min(timed(g.compile)[0] for _ in range(repeat))
+    return results
+
+def bench_throughput(grammar, engine, sentences, repeat):
+    p = parser.Parser(grammar, engine=engine)
+    times = []
+    trees = 0
+    for _ in range(repeat):
+        for words in sentences:
+            (t, chart) = timed(p.fill, words)
+            times.append(t)
+            trees += chart.root().count() if chart.root() else 0
+    return {'sentences': len(times),
+            'sentences_per_sec': len(times) / sum(times),
+            'latency': latency_summary(times),
+            'trees': trees // repeat}
+
+def bench_scaling(grammar, engine, family, sizes, repeat):
+    p = parser.Parser(grammar, engine=engine)
+    rows = []
+    for n in sizes:
+        words = FAMILIES[family](n)
+        times = []
+        for _ in range(repeat):
+            (t, chart) = timed(p.fill, words)
+            times.append(t)
+
+        gc.collect()
+        tracemalloc.start()
+        chart = p.fill(words)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        row = {'n': n, 'words': len(words), 'time': min(times),
+               'trees': chart.root().count() if chart.root() else 0,
+               'peak_bytes': peak}
+        row.update(chart_size(chart))
+        rows.append(row)
+    return rows
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(quick=False, repeat=None):
+    if repeat is None:
+        repeat = 1 if quick else 5
+    sizes = range(1, 4) if quick else range(1, 13)
+
+    with open(fg1 + '.sents') as f:
+        sentences = [line.split() for line in f if line.strip()]
+
+    g = parser.Grammar(fg1)
+    cg = g.compile()
+    configs = {'plain': (g, 'agenda'), 'compiled': (cg, 'agenda'),
+               'cky': (g, 'cky'), 'compiled_cky': (cg, 'cky')}
+
+    results = {'revision': git_revision(),
+               'python': platform.python_version(),
+               'repeat': repeat,
+               'load': bench_load(repeat),
+               'throughput': {},
+               'scaling': {}}
+    for (name, (grammar, engine)) in configs.items():
+        results['throughput'][name] = bench_throughput(grammar, engine, sentences, repeat)
+        results['scaling'][name] = dict(
+            (family, bench_scaling(grammar, engine, family, sizes, repeat))
+            for family in FAMILIES)
+    return results
+
+
+#--  Reporting  ----------------------------------------------------------------
+
+def report(results, out=sys.stdout):
+    ms = lambda t: '%.2fms' % (1000 * t)
+
+    print('revision %s, python %s, repeat %d'
+          % (results['revision'], results['python'], results['repeat']), file=out)
+    print(file=out)
+    print('Load', file=out)
+    for (name, t) in results['load'].items():
+        print('  %-12s %10s' % (name, ms(t)), file=out)
+
+    print(file=out)
+    print('Throughput on fg1.sents', file=out)
+    for (name, r) in results['throughput'].items():
+        lat = r['latency']
+        print('  %-12s %8.1f sent/s  p50 %s  p90 %s  p99 %s  max %s'
+              % (name, r['sentences_per_sec'], ms(lat['p50']), ms(lat['p90']),
+                 ms(lat['p99']), ms(lat['max'])), file=out)
+
+    for (name, families) in results['scaling'].items():
+        for (family, rows) in families.items():
+            print(file=out)
+            print('Scaling: %s, %s' % (family, name), file=out)
+            print('  %3s %6s %10s %10s %8s %8s %10s'
+                  % ('n', 'words', 'time', 'trees', 'nodes', 'edges', 'peak KiB'),
+                  file=out)
+            for row in rows:
+                print('  %3d %6d %10s %10d %8d %8d %10.1f'
+                      % (row['n'], row['words'], ms(row['time']), row['trees'],
+                         row['nodes'], row['edges'], row['peak_bytes'] / 1024.0),
+                      file=out)
+
+def main(argv):
+    quick = False
+    json_file = None
+    repeat = None
+    ac = 0
+    while ac < len(argv):
+        if argv[ac] == '--quick':
+            quick = True
+        elif argv[ac] == '--json':
+            ac += 1
+            json_file = argv[ac]
+        elif argv[ac] == '--repeat':
+            ac += 1
+            repeat = int(argv[ac])
+        else:
+            raise Exception('Unknown argument: %s' % argv[ac])
+        ac += 1
+
+    results = run(quick, repeat)
+    if json_file == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return results
+
+    report(results)
+    if json_file:
+        with open(json_file, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
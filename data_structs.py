@@ -1,6 +1,8 @@
 import random
 
 class Tree:
+    __slots__ = ('cat', 'word', 'children', 'terminal')
+
     def __init__(self, category, children=None, word=None):
         self.cat = category
         self.word = word
@@ -20,7 +22,6 @@ class Tree:
         string += '(' + str(node.cat)
 
         if isleaf(node):
-            print (node.word)
             string += ' ' + node.word + ')'
             return string
         else:
@@ -0,0 +1,6 @@
+S -> NP VP
+NP -> Det N
+NP -> NP PP @-1.0
+VP -> V NP
+VP -> VP PP @-0.5
+PP -> P NP
@@ -1,4 +1,14 @@
+import collections
+import hashlib
+import heapq
+import itertools
+import mmap
+import os
+import pickle
 import re
+import struct
+import threading
+import time
 import data_structs
 from data_structs import Tree
 
@@ -32,6 +42,13 @@ class Category(tuple):
                 parts.append(str(part))
         return ".".join(parts)
 
+def split_score(string):
+    # "Cat@-0.5" -> ("Cat", -0.5); a missing score counts as 0
+    if '@' in string:
+        string, score = string.rsplit('@', 1)
+        return string, float(score)
+    return string, 0.0
+
 def tokenize(string):
     return re.findall(r'\(|\)|[^()\s]+',string)
 
@@ -109,6 +126,9 @@ class Lexicon:
     def __init__(self, file_name):
         self.wrds = Index()
         self.prts = Index()
+        self.scores = {}
+        self.folded = None
+        self.suffixes = None
 
         file = open(file_name, "r")
 
@@ -120,23 +140,303 @@ class Lexicon:
             word = secs[0]
 
             for part in secs[1:]:
+                part, score = split_score(part)
                 cat = parse_category(part)
+                if (word, cat) in self.scores:
+                    self.scores[word, cat] = max(score, self.scores[word, cat])
+                    continue
+
+                self.scores[word, cat] = score
                 self.prts.add(word, cat)
                 self.wrds.add(cat[0], word)
 
         file.close()
 
     def parts(self, word):
-        return self.prts[word]
+        parts = self.prts.map.get(word)
+        if parts is None:
+            return self.guess(word)
+        return parts
 
     def words(self, part):
         return self.wrds[part]
 
+    def score(self, word, part):
+        return self.scores.get((word, part), 0.0)
+
+    def known(self, word):
+        # whether word is in the lexicon itself, not just guessed
+        return word in self.prts.map
+
+    def lookup(self, words):
+        return [self.parts(word) for word in words]
+
+    def unknown(self, words):
+        # The words with no parts at all; a sentence containing one cannot
+        # parse, so callers can reject it before doing any chart work.
+        return [word for word in words if not self.parts(word)]
+
+    def categories(self):
+        return set(cat for parts in self.prts.map.values() for cat in parts)
+
+    def add_fallbacks(self, fold_case=False, suffixes=0, open_class=10):
+        # Tables for words missing from the lexicon: the parts of the
+        # case-folded word, and else the parts that known words with the
+        # same ending (up to suffixes letters long) have.  Suffixes only
+        # propose open-class parts: heads with at least open_class words.
+        self.folded = None
+        if fold_case:
+            self.folded = {}
+            for (word, parts) in self.prts.map.items():
+                folded = self.folded.setdefault(word.lower(), [])
+                folded.extend(cat for cat in parts if cat not in folded)
+
+        self.suffixes = None
+        if suffixes:
+            self.suffixes = {}
+            for (word, parts) in self.prts.map.items():
+                parts = [cat for cat in parts
+                         if len(self.wrds[cat[0]]) >= open_class]
+                for k in range(1, min(suffixes, len(word) - 1) + 1):
+                    guesses = self.suffixes.setdefault(word[-k:], [])
+                    guesses.extend(cat for cat in parts if cat not in guesses)
+            self.suffix_len = suffixes
+
+    def guess(self, word):
+        if self.folded is not None:
+            parts = self.folded.get(word.lower())
+            if parts:
+                return parts
+        if self.suffixes is not None:
+            for k in range(min(self.suffix_len, len(word) - 1), 0, -1):
+                parts = self.suffixes.get(word[-k:])
+                if parts:
+                    return parts
+        return []
+
+LEXMAP_MAGIC = b"PARSERLX"
+LEXMAP_VERSION = 1
+LEXMAP_HEADER = struct.Struct("<8sIIII")
+U16 = struct.Struct("<H")
+U32 = struct.Struct("<I")
+U64 = struct.Struct("<Q")
+ENTRY = struct.Struct("<Id")
+
+def write_mapped_lexicon(lexicon, path):
+    # Writes lexicon in the MappedLexicon format:
+    #   header: magic, version, #categories, #words, #heads
+    #   three tables of u64 record offsets: categories (by id), words and
+    #   heads (both sorted by their UTF-8 bytes)
+    #   category record: u16 length, bytes
+    #   word record: u16 length, bytes, u16 count, count x (u32 category, f64 score)
+    #   head record: u16 length, bytes, u32 count, count x u64 word record offset
+    cats = sorted(lexicon.categories(), key=str)
+    cat_ids = dict((cat, i) for (i, cat) in enumerate(cats))
+    words = sorted(lexicon.prts.map, key=lambda word: word.encode())
+    heads = sorted(lexicon.wrds.map, key=lambda head: head.encode())
+
+    data = bytearray()
+    base = LEXMAP_HEADER.size + 8 * (len(cats) + len(words) + len(heads))
+
+    def record(key):
+        key = key.encode()
+        offset = base + len(data)
+        data.extend(U16.pack(len(key)))
+        data.extend(key)
+        return offset
+
+    cat_offsets = [record(str(cat)) for cat in cats]
+
+    word_offsets = []
+    word_at = {}
+    for word in words:
+        offset = word_at[word] = record(word)
+        word_offsets.append(offset)
+        parts = lexicon.prts.map[word]
+        data.extend(U16.pack(len(parts)))
+        for cat in parts:
+            data.extend(ENTRY.pack(cat_ids[cat], lexicon.score(word, cat)))
+
+    head_offsets = []
+    for head in heads:
+        head_offsets.append(record(head))
+        entries = lexicon.wrds[head]
+        data.extend(U32.pack(len(entries)))
+        for word in entries:
+            data.extend(U64.pack(word_at[word]))
+
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(LEXMAP_HEADER.pack(LEXMAP_MAGIC, LEXMAP_VERSION,
+                                   len(cats), len(words), len(heads)))
+        for offset in cat_offsets + word_offsets + head_offsets:
+            f.write(U64.pack(offset))
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class MappedLexicon:
+    # A lexicon read straight from a file written by write_mapped_lexicon.
+    # The file is memory-mapped, so processes using the same file share one
+    # copy through the page cache, and lookups binary-search the sorted
+    # tables instead of building dicts.  Same interface as Lexicon, except
+    # that it has no add_fallbacks or guess: the fallback tables would be
+    # dicts over the whole lexicon, so unknown words simply have no parts.
+    # Close it when done, or use it in a with statement.
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, ncats, nwords, nheads) = LEXMAP_HEADER.unpack_from(self.map, 0)
+        if magic != LEXMAP_MAGIC or version != LEXMAP_VERSION:
+            raise ValueError("%s is not a version %d mapped lexicon"
+                             % (path, LEXMAP_VERSION))
+
+        self.cat_table = LEXMAP_HEADER.size
+        self.word_table = self.cat_table + 8 * ncats
+        self.head_table = self.word_table + 8 * nwords
+        self.nwords = nwords
+        self.nheads = nheads
+        self.cats = [None] * ncats
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    def key(self, offset):
+        # the key of the record at offset, and where the rest of it starts
+        n = U16.unpack_from(self.map, offset)[0]
+        return (self.map[offset + 2:offset + 2 + n], offset + 2 + n)
+
+    def find(self, table, n, key):
+        key = key.encode()
+        (lo, hi) = (0, n)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = U64.unpack_from(self.map, table + 8 * mid)[0]
+            (found, rest) = self.key(offset)
+            if found == key:
+                return rest
+            elif found < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def category(self, i):
+        cat = self.cats[i]
+        if cat is None:
+            offset = U64.unpack_from(self.map, self.cat_table + 8 * i)[0]
+            cat = self.cats[i] = parse_category(self.key(offset)[0].decode())
+        return cat
+
+    def categories(self):
+        return set(self.category(i) for i in range(len(self.cats)))
+
+    def entries(self, word):
+        rest = self.find(self.word_table, self.nwords, word)
+        if rest is None:
+            return []
+        count = U16.unpack_from(self.map, rest)[0]
+        return [ENTRY.unpack_from(self.map, rest + 2 + ENTRY.size * k)
+                for k in range(count)]
+
+    def parts(self, word):
+        return [self.category(i) for (i, score) in self.entries(word)]
+
+    def known(self, word):
+        return self.find(self.word_table, self.nwords, word) is not None
+
+    def words(self, part):
+        rest = self.find(self.head_table, self.nheads, part)
+        if rest is None:
+            return []
+        count = U32.unpack_from(self.map, rest)[0]
+        return [self.key(U64.unpack_from(self.map, rest + 4 + 8 * k)[0])[0].decode()
+                for k in range(count)]
+
+    def score(self, word, part):
+        for (i, score) in self.entries(word):
+            if self.category(i) == part:
+                return score
+        return 0.0
+
+    def lookup(self, words):
+        return [self.parts(word) for word in words]
+
+    def unknown(self, words):
+        return [word for word in words if not self.parts(word)]
+
+
+def make_plan(source, x, star):
+    # Precompiles the unification of category x (the encoded form of source,
+    # whose variables are ints) into the feature positions to check against
+    # a constant and the positions that bind a variable.  Wildcards and the
+    # head are left out; callers look candidates up by head.
+    checks = []
+    binds = []
+    for i in range(1, len(source)):
+        if isinstance(source[i], int):
+            binds.append((i, source[i]))
+        elif x[i] != star:
+            checks.append((i, x[i]))
+    return (len(x), star, tuple(checks), tuple(binds))
+
+def unify_plan(plan, y, b):
+    (n, star, checks, binds) = plan
+    if len(y) != n:
+        return None
+
+    for (i, c) in checks:
+        v = y[i]
+        if v != c and v != star:
+            return None
+
+    bindings = b
+    for (i, k) in binds:
+        v = y[i]
+        u = bindings[k]
+        if u == v or v == star:
+            continue
+        if u != star:
+            return None
+        if bindings is b:
+            bindings = list(b)
+        bindings[k] = v
+
+    return b if bindings is b else tuple(bindings)
+
+def make_slots(source):
+    return tuple((i, f) for (i, f) in enumerate(source) if isinstance(f, int))
+
+def instantiate(x, slots, b):
+    # subst() for a category whose variable positions are precomputed
+    if not slots:
+        return x
+    cat = list(x)
+    for (i, k) in slots:
+        cat[i] = b[k]
+    return x.__class__(cat)
+
 class Rule:
-    def __init__(self, lhs, rhs, b=None):
+    def __init__(self, lhs, rhs, b=None, score=0.0):
         self.lhs = lhs
         self.rhs = rhs
         self.bindings = b
+        self.score = score
 
         assert(isinstance(lhs, Category))
         for cat in rhs:
@@ -155,19 +455,214 @@ class Rule:
 
             self.bindings = tuple(['*' for x in range(num_vars)])
 
+        self.plans = tuple(make_plan(cat, cat, '*') for cat in rhs)
+        self.slots = make_slots(lhs)
+
     def __repr__(self):
         return str(self.lhs) + " -> " + " ".join([str(cat) for cat in self.rhs])
 
+def left_corner_table(grammar):
+    # lc[B] is the set of heads that can begin a constituent headed by B,
+    # B itself included; heads that head no rule are missing from the table.
+    direct = {}
+    for rule in grammar.rules():
+        direct.setdefault(rule.lhs[0], set()).add(rule.rhs[0][0])
+
+    lc = {}
+    for head in direct:
+        seen = {head}
+        stack = [head]
+        while stack:
+            for corner in direct.get(stack.pop(), ()):
+                if corner not in seen:
+                    seen.add(corner)
+                    stack.append(corner)
+        lc[head] = frozenset(seen)
+
+    return lc
+
+def care_positions(grammar, rule, dot):
+    # The feature positions at which rhs[dot] of rule looks at a category:
+    # those holding a constant, or a variable that occurs again in the rule.
+    # A '*' or a variable used only there accepts any value and binds
+    # nothing that is read later.  Memoized per grammar; see Chart.cover.
+    key = (rule, dot)
+    cares = grammar.cares.get(key)
+    if cares is None:
+        star = STAR if grammar.compiled else '*'
+        isvar = (lambda f: f < 0) if grammar.compiled else (lambda f: isinstance(f, int))
+        uses = collections.Counter(f for cat in (rule.lhs,) + tuple(rule.rhs)
+                                   for f in cat[1:] if isvar(f))
+        x = rule.rhs[dot]
+        cares = grammar.cares[key] = frozenset(
+            i for i in range(1, len(x))
+            if x[i] != star and (not isvar(x[i]) or uses[x[i]] > 1))
+    return cares
+
+class FeatureIndex:
+    # Discrimination index over categories sharing a head.  Each item is
+    # added with the length of its category and its constraints: the
+    # (position, value) pairs it needs the other category to have (or
+    # '*' there).  Bit k of each mask stands for the k-th item, so the
+    # candidates come back in the order the items were added.
+    def __init__(self, star):
+        self.star = star
+        self.items = []
+        self.lengths = {}
+        self.constrained = {}
+        self.values = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item, n, constraints):
+        bit = 1 << len(self.items)
+        self.items.append(item)
+        self.lengths[n] = self.lengths.get(n, 0) | bit
+        for (i, value) in constraints:
+            self.constrained[i] = self.constrained.get(i, 0) | bit
+            self.values[(i, value)] = self.values.get((i, value), 0) | bit
+
+    def candidates(self, y):
+        # the items that can unify with category y
+        mask = self.lengths.get(len(y), 0)
+        for (i, constrained) in self.constrained.items():
+            if not mask:
+                break
+            if i < len(y) and y[i] != self.star:
+                mask &= ~constrained | self.values.get((i, y[i]), 0)
+        return [self.items[k] for k in bits(mask)]
+
+def rule_candidates(grammar, cat):
+    # Rules whose first RHS category can unify with cat, in the order of
+    # grammar.continuations, memoized by cat
+    rules = grammar.starts_memo.get(cat)
+    if rules is None:
+        index = grammar.starts_index.get(cat[0])
+        if index is None:
+            index = FeatureIndex(STAR if grammar.compiled else '*')
+            for rule in grammar.continuations(cat[0]):
+                (n, star, checks, binds) = rule.plans[0]
+                index.add(rule, n, checks)
+            grammar.starts_index[cat[0]] = index
+        rules = grammar.starts_memo[cat] = index.candidates(cat)
+    return rules
+
+def bits(mask):
+    # indices of the set bits of mask, lowest first
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+CACHE_MAGIC = b"PARSERGC"
+
+# Bumped whenever the pickled classes change layout:
+#   1  Grammar state of Rules, Lexicon and the start category
+#   2  Rules carry precompiled plans and slots, Lexicons their fallbacks
+# The header also holds a hash of the modules defining those classes, so a
+# forgotten bump cannot let a stale cache through; see cache_layout().
+CACHE_VERSION = 2
+
+layout = None
+
+def cache_layout():
+    global layout
+    if layout is None:
+        digest = hashlib.sha256()
+        for module in (__file__, data_structs.__file__):
+            with open(module, "rb") as f:
+                digest.update(f.read())
+        layout = digest.hexdigest()[:16]
+    return layout
+
+def cache_header(key):
+    return CACHE_MAGIC + b" %d %s %s\n" % (CACHE_VERSION, cache_layout().encode(),
+                                           key.encode())
+
+def read_cache(path, key):
+    # Returns the cached state, or None if the cache is missing, was written
+    # by another format version or build of the parser, or belongs to
+    # different source files.
+    header = cache_header(key)
+    try:
+        with open(path, "rb") as f:
+            if f.readline() != header:
+                return None
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+def write_cache(path, key, state):
+    # Written under a temporary name and renamed, so that concurrent
+    # workers never see a half-written cache.
+    header = cache_header(key)
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(tmp, "wb") as f:
+            f.write(header)
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
 class Grammar:
-    def __init__(self, file_name):
+    compiled = False
+
+    def __init__(self, file_name, cache=None, lexicon=None):
         self.file_name = file_name
         self.exps = Index()
+
+        # lexicon: used instead of reading <file_name>.lex, e.g. a
+        # MappedLexicon, or the path of a file for one
+        if isinstance(lexicon, str):
+            lexicon = MappedLexicon(lexicon)
+        self.given_lexicon = lexicon
         self.conts = Index()
 
+        # cache: True for <file_name>.gcache, or the path of the cache file
+        if cache is True:
+            cache = file_name + ".gcache"
+        self.cache = cache
+        self.cache_hit = False
+        self.version = 0
+
         self.load()
 
     def load(self):
-        self.lexicon = Lexicon(self.file_name + ".lex")
+        # version counts loads, so that caches of parse results can tell
+        # when the grammar they were made with has gone
+        self.version += 1
+        if not self.cache:
+            self.read()
+        else:
+            key = self.source_hash()
+            state = read_cache(self.cache, key)
+            self.cache_hit = state is not None
+            if self.cache_hit:
+                (lexicon, self.exps, self.conts, self.start) = state
+                self.lexicon = self.given_lexicon or lexicon
+            else:
+                self.read()
+                lexicon = None if self.given_lexicon else self.lexicon
+                write_cache(self.cache, key,
+                            (lexicon, self.exps, self.conts, self.start))
+
+        self.lc = left_corner_table(self)
+        self.starts_index = {}
+        self.starts_memo = {}
+        self.cares = {}
+
+    def source_hash(self):
+        digest = hashlib.sha256()
+        for ext in (".g",) if self.given_lexicon else (".g", ".lex"):
+            with open(self.file_name + ext, "rb") as f:
+                digest.update(f.read())
+        return digest.hexdigest()
+
+    def read(self):
+        self.lexicon = self.given_lexicon or Lexicon(self.file_name + ".lex")
         self.exps = Index()
         self.conts = Index()
 
@@ -188,15 +683,20 @@ class Grammar:
                 print("Error in read line")
                 exit()
 
+            score = 0.0
+            if parts[-1][0] == '@':
+                score = float(parts.pop()[1:])
+
             t = {}
             for i in range(len(parts)):
                 if i != 1:
                     parts[i] = parse_category(parts[i],t)
             
             assert(isinstance(parts[0], Category))
-            self.exps.add(parts[0][0], Rule(parts[0], parts[2:]))
             assert(isinstance(parts[2], Category))
-            self.conts.add(parts[2][0], Rule(parts[0], tuple(parts[2:])))
+            rule = Rule(parts[0], tuple(parts[2:]), score=score)
+            self.exps.add(parts[0][0], rule)
+            self.conts.add(parts[2][0], rule)
 
         self.start = parse_category(lines[0].split()[0])
 
@@ -207,17 +707,270 @@ class Grammar:
     def expansions(self, part):
         return self.exps[part]
 
+    def rules(self):
+        for rules in self.exps.map.values():
+            for rule in rules:
+                yield rule
+
     def continuations(self, part):
         return self.conts[part]
 
+    def starts(self, cat):
+        return rule_candidates(self, cat)
+
     def isterm(self, part):
         return self.exps[part] == []
 
+    def compile(self):
+        return CompiledGrammar(self)
+
+    def score(self, cat, children):
+        # Best score of a rule that builds cat from the children categories;
+        # None if no rule does.
+        best = None
+        for rule in self.expansions(cat[0]):
+            if len(rule.rhs) != len(children):
+                continue
+
+            b = rule.bindings
+            for (x, y) in zip(rule.rhs, children):
+                if x[0] != y[0] or len(x) != len(y):
+                    b = None
+                else:
+                    b = unify(x, y, b)
+                if b is None:
+                    break
+
+            if b is not None and subst(b, rule.lhs) == cat:
+                if best is None or rule.score > best:
+                    best = rule.score
+
+        return best
+
+# Compiled categories are tuples of ints: STAR is the wildcard and variable
+# k is stored as ~k
+STAR = 0
+
+class Symbols:
+    # Interns category heads and feature values to small ints; '*' is 0.
+    def __init__(self):
+        self.ids = {'*': STAR}
+        self.names = ['*']
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        if name in self.ids:
+            return self.ids[name]
+        i = self.ids[name] = len(self.names)
+        self.names.append(name)
+        return i
+
+    def name(self, i):
+        return self.names[i]
+
+
+class CompiledRule:
+    def __init__(self, rule, grammar):
+        self.rule = rule
+        self.lhs = grammar.encode(rule.lhs)
+        self.rhs = tuple(grammar.encode(cat) for cat in rule.rhs)
+        self.bindings = (STAR,) * len(rule.bindings)
+        self.score = rule.score
+        self.plans = tuple(make_plan(src, cat, STAR)
+                           for (src, cat) in zip(rule.rhs, self.rhs))
+        self.slots = make_slots(rule.lhs)
+
+    def __repr__(self):
+        return repr(self.rule)
+
+
+class CompiledLexicon:
+    def __init__(self, lexicon, grammar):
+        self.lexicon = lexicon
+        self.grammar = grammar
+        self.prts = {}
+
+        # Intern every symbol now, so that encoding entries on first use
+        # (and guesses, which are built of known categories) never adds any.
+        for cat in lexicon.categories():
+            grammar.encode(cat)
+
+    def parts(self, word):
+        # Only words in the lexicon are memoized: guesses for unknown words
+        # are encoded afresh each time, so that a stream of new misspellings
+        # cannot grow prts without bound
+        parts = self.prts.get(word)
+        if parts is None:
+            parts = [self.grammar.encode(cat) for cat in self.lexicon.parts(word)]
+            if parts and self.lexicon.known(word):
+                self.prts[word] = parts
+        return parts
+
+    def known(self, word):
+        return self.lexicon.known(word)
+
+    def words(self, part):
+        return self.lexicon.words(self.grammar.symbols.name(part))
+
+    def lookup(self, words):
+        return [self.parts(word) for word in words]
+
+    def unknown(self, words):
+        return [word for word in words if not self.parts(word)]
+
+    def score(self, word, part):
+        return self.lexicon.score(word, self.grammar.decode(part))
+
+
+class CompiledGrammar:
+    # Grammar with every head and feature value interned to a small int and
+    # rules kept in lists indexed by head id.  Parser runs over it directly;
+    # trees are decoded back to Categories on the way out.
+    compiled = True
+
+    def __init__(self, grammar):
+        # a snapshot of grammar as loaded now; see refresh
+        self.source = grammar
+        self.version = grammar.version
+        self.symbols = Symbols()
+        self.decoded = {}
+
+        rules = []
+        for part in grammar.exps.map:
+            for rule in grammar.exps[part]:
+                rules.append(CompiledRule(rule, self))
+
+        self.lexicon = CompiledLexicon(grammar.lexicon, self)
+        self.start = self.encode(grammar.start)
+
+        self.exps = [[] for x in range(len(self.symbols))]
+        self.conts = [[] for x in range(len(self.symbols))]
+        for rule in rules:
+            self.exps[rule.lhs[0]].append(rule)
+            self.conts[rule.rhs[0][0]].append(rule)
+
+        self.lc = left_corner_table(self)
+        self.starts_index = {}
+        self.starts_memo = {}
+        self.cares = {}
+
+    def refresh(self):
+        # Compiles the source again if it has been reloaded since; see
+        # Parser.refresh
+        if self.version != self.source.version:
+            self.__init__(self.source)
+
+    def encode(self, cat):
+        return tuple([~f if isinstance(f, int) else self.symbols.intern(f)
+                      for f in cat])
+
+    def decode(self, cat):
+        if cat not in self.decoded:
+            self.decoded[cat] = Category([~f if f < 0 else self.symbols.name(f)
+                                          for f in cat])
+        return self.decoded[cat]
+
+    def decode_tree(self, tree):
+        if tree.word is not None:
+            return Tree(self.decode(tree.cat), word=tree.word)
+        return Tree(self.decode(tree.cat),
+                    tuple(self.decode_tree(child) for child in tree.children))
+
+    def expansions(self, part):
+        if part < len(self.exps):
+            return self.exps[part]
+        return []
+
+    def rules(self):
+        for rules in self.exps:
+            for rule in rules:
+                yield rule
+
+    def continuations(self, part):
+        if part < len(self.conts):
+            return self.conts[part]
+        return []
+
+    def starts(self, cat):
+        return rule_candidates(self, cat)
+
+    def isterm(self, part):
+        return self.expansions(part) == []
+
+    def score(self, cat, children):
+        return self.source.score(self.decode(cat),
+                                 [self.decode(c) for c in children])
+
+
 class Edge:
+    # An edge is its last node plus a back-pointer to the edge it extends,
+    # so advancing the dot never copies the expansion.  alts holds the
+    # (prev, node) pairs of equivalent edges merged into this one.
+    __slots__ = ('rule', 'prev', 'node', 'dot', 'i', 'bindings', 'score', 'alts')
+
     def __init__(self, rule, expansion, bindings):
         self.rule = rule
-        self.expansion = expansion
+        self.prev = None
+        self.node = None
+        self.dot = len(expansion)
+        self.i = None
         self.bindings = bindings
+        self.score = rule.score + sum(node.score for node in expansion)
+        self.alts = None
+        if expansion:
+            if len(expansion) > 1:
+                self.prev = Edge(rule, expansion[:-1], rule.bindings)
+            self.node = expansion[-1]
+            self.i = expansion[0].i
+
+    @property
+    def expansion(self):
+        nodes = []
+        edge = self
+        while edge is not None and edge.node is not None:
+            nodes.append(edge.node)
+            edge = edge.prev
+        nodes.reverse()
+        return nodes
+
+    def expansions(self):
+        # Every expansion packed into this edge, through the alternatives of
+        # its own and of the edges before it; expansion is the first one
+        if self.node is None:
+            return [[]]
+        pairs = [(self.prev, self.node)]
+        if self.alts:
+            pairs.extend(self.alts)
+
+        expansions = []
+        for (prev, node) in pairs:
+            if prev is None:
+                expansions.append([node])
+            else:
+                expansions.extend(nodes + [node] for nodes in prev.expansions())
+        return expansions
+
+    def merge(self, other):
+        # Packs other, an equivalent edge, into this one
+        if self.alts is None:
+            self.alts = []
+        self.alts.append((other.prev, other.node))
+        if other.score > self.score:
+            self.score = other.score
+
+    def advance(self, node, bindings):
+        new = Edge.__new__(Edge)
+        new.rule = self.rule
+        new.prev = self
+        new.node = node
+        new.dot = self.dot + 1
+        new.i = self.i
+        new.bindings = bindings
+        new.score = self.score + node.score
+        new.alts = None
+        return new
 
     def __repr__(self):
         return "<Edge " + self.__str__() + ">"
@@ -225,177 +978,1281 @@ class Edge:
     def __str__(self):
         string = str(self.rule.lhs) + " -> "
         for node in self.expansion:
-            # print (self.expansion)
             string += "[" + " ".join([str(node.i), str(node.cat), str(node.j)]) + "] "
         string += "* "
 
-        for part in self.rule.rhs[len(self.expansion):]:
+        for part in self.rule.rhs[self.dot:]:
             string += str(part) + " "
             
-        string += ": " + " ".join([feature for feature in self.bindings])
+        string += ": " + " ".join([str(feature) for feature in self.bindings])
         return string
     
     def __add__(self, rhs):
         assert(isinstance(rhs, Node))
-        new = Edge(self.rule, self.expansion + [rhs], self.rule.bindings)
-        assert(isinstance(new, Edge))
-        return new
+        return self.advance(rhs, self.rule.bindings)
 
     def cat(self):
         return self.rule.lhs
 
     def start(self):
-        return self.expansion[0].i
+        return self.i
 
     def end(self):
-        return self.expansion[-1].j
+        return self.node.j
 
     def afterdot(self):
-        dot_pos = len(self.expansion)
-        if dot_pos >= len(self.rule.rhs):
+        if self.dot >= len(self.rule.rhs):
             return None
         else:
-            return self.rule.rhs[dot_pos]
+            return self.rule.rhs[self.dot]
 
-class Parser():
-    def __init__(self, grammar):
-        self.grammar = grammar
-        self.chart = {}
-        self.edges = Index()
-        self.todo = []
-        self.words = None
+class NodeItem:
+    __slots__ = ('cat', 'expansion', 'i', 'j', 'score')
 
-    def reset(self, words):
+    def __init__(self, cat, expansion, i, j, score=0.0):
+        self.cat = cat
+        self.expansion = expansion
+        self.i = i
+        self.j = j
+        self.score = score
+
+    def apply(self, chart):
+        chart.AddNode(self.cat, self.expansion, self.i, self.j, self.score)
+
+    def span(self):
+        return self.j - self.i
+
+    def __eq__(self, other):
+        return (isinstance(other, NodeItem) and
+                (self.cat, self.expansion, self.i, self.j) ==
+                (other.cat, other.expansion, other.i, other.j))
+
+    def __repr__(self):
+        return 'NodeItem(%r, %r, %r, %r)' % (self.cat, self.expansion, self.i, self.j)
+
+
+class EdgeItem:
+    __slots__ = ('edge', 'score')
+
+    def __init__(self, edge):
+        self.edge = edge
+        self.score = edge.score
+
+    def apply(self, chart):
+        chart.AddEdge(self.edge)
+
+    def span(self):
+        return self.edge.end() - self.edge.i
+
+    def __eq__(self, other):
+        return isinstance(other, EdgeItem) and self.edge is other.edge
+
+    def __repr__(self):
+        return 'EdgeItem(%r)' % self.edge
+
+
+# Agendas hold the NodeItems and EdgeItems waiting to be added to a chart.
+# Each has push, pop and len; which one a Parser uses decides the order in
+# which the chart is filled.
+
+class Stack(list):
+    push = list.append
+
+class Queue(collections.deque):
+    push = collections.deque.append
+    pop = collections.deque.popleft
+
+class PriorityAgenda:
+    # Pops the item with the smallest key first; ties go first in, first out
+    def __init__(self, key):
+        self.key = key
+        self.heap = []
+        self.count = 0
+
+    def push(self, item):
+        heapq.heappush(self.heap, (self.key(item), self.count, item))
+        self.count += 1
+
+    def pop(self):
+        return heapq.heappop(self.heap)[2]
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __iter__(self):
+        return (entry[2] for entry in sorted(self.heap))
+
+# Keys are module-level functions so that agendas, and the parsers and
+# charts holding them, can be pickled
+
+def span_key(item):
+    return item.span()
+
+def score_key(item):
+    return -item.score
+
+def span_agenda():
+    # shortest spans first, so the chart fills much as in CKY
+    return PriorityAgenda(span_key)
+
+def score_agenda():
+    # highest inside score first, for best-first parsing
+    return PriorityAgenda(score_key)
+
+AGENDAS = {'stack': Stack, 'fifo': Queue, 'span': span_agenda, 'score': score_agenda}
+
+
+# Waiting edge lists this long are filtered through a FeatureIndex before
+# unification; shorter ones are cheaper to try one by one
+INDEX_MIN_EDGES = 8
+
+
+class Chart:
+    # The state of one parse: the chart of nodes, the edges waiting at each
+    # position and the agenda.  Every call to Parser builds its own Chart, so
+    # one Parser can serve concurrent calls.
+    def __init__(self, parser, words, final=True):
+        # final is False while words are still being fed in, see feed()
+        self.parser = parser
+        self.grammar = parser.grammar
+        self.final = final
+        # set when run() turns the words down for an unknown word without
+        # filling anything; such a chart is no prefix to resume from
+        self.rejected = False
         self.chart = {}
         self.edges = Index()
-        self.todo = []
+        self.todo = parser.agenda()
         self.words = words
-
-    def __call__(self, words):
-        self.reset(words)
+        self.stats = None
+        self.unify = unify_plan
+
+        self.edge_indexes = {}
+
+        # incomplete edges ending at the current position, by signature;
+        # see AddEdge
+        self.seen = {}
+
+        # packing of nodes covered by more general ones; see cover.  Only
+        # nodes ending at the current position are kept.
+        self.pack = parser.pack
+        self.spans = {}
+        self.derived = {}
+
+        # left-corner and lookahead filtering; see allowed() and viable()
+        self.prune = parser.prune
+        self.expected = Index()
+        self.allowed_at = {}
+        self.lookahead = {}
+
+    def run(self, begin=0):
+        # begin > 0 when the chart was restored from a prefix; see restore()
+        if begin == 0 and self.grammar.lexicon.unknown(self.words):
+            self.rejected = True
+            return None
 
         #Main Loop
-        for j in range(1, len(words) + 1):           
+        n = len(self.words)
+        for j in range(begin + 1, n + 1):           
             self.shift(j)
+            if j == n and self.parser.first:
+                # stop as soon as a complete parse of the input turns up,
+                # leaving the rest of the agenda undone
+                key = (self.grammar.start, 0, n)
+                while self.todo and key not in self.chart:
+                    self.step()
+                return self.root()
             while self.todo:
                 self.step()
-
-        if (self.grammar.start, 0, len(self.words)) in self.chart:
-            node = self.chart[(self.grammar.start, 0, len(self.words))]
-
-            # print (node)
-
-            return node.trees()
-        else:
+        return self.root()
+
+    def root(self):
+        return self.chart.get((self.grammar.start, 0, len(self.words)))
+
+    def restore(self, other, m):
+        # Takes over everything other found within its first m words.
+        # Nothing ending at or before m changes once the parse has moved past
+        # m, so nodes, edges and edge lists are shared, not copied.
+        self.chart = dict((key, node) for (key, node) in other.chart.items()
+                          if key[2] <= m)
+        self.edges.map = dict((key, edges) for (key, edges) in other.edges.map.items()
+                              if key[0] <= m)
+        self.expected.map = dict((j, heads) for (j, heads) in other.expected.map.items()
+                                 if j <= m)
+        self.allowed_at = dict((i, heads) for (i, heads) in other.allowed_at.items()
+                               if i < m)
+
+    def size(self):
+        # rough size in bytes, for bounding caches of charts
+        return 200 * len(self.chart) + 150 * sum(map(len, self.edges.map.values()))
+
+    def itertrees(self, limit=None):
+        node = self.root()
+        if node is None:
+            return iter(())
+
+        trees = node.itertrees(limit)
+        if self.grammar.compiled:
+            trees = map(self.grammar.decode_tree, trees)
+        return trees
+
+    def trees(self, limit=None):
+        return list(self.itertrees(limit))
+
+    def kbest(self, k):
+        node = self.root()
+        if node is None:
             return []
 
+        best = KBest(self.grammar).best(node, k)
+        if self.grammar.compiled:
+            best = [(score, self.grammar.decode_tree(t)) for (score, t) in best]
+        return best
+
+    def feed(self, word):
+        # Incremental parsing: extends the chart by one word, reusing all the
+        # work done on the prefix.  Returns whether the words so far have a
+        # complete parse.
+        self.words.append(word)
+        self.shift(len(self.words))
+        while self.todo:
+            self.step()
+        return self.root() is not None
+
+    def partial_state(self):
+        # The active edges that the next word can extend
+        j = len(self.words)
+        return [edge for head in self.expected[j] for edge in self.edges[j, head]]
+
     def ToAdd(self, item):
-        self.todo.append(item)
+        self.todo.push(item)
 
     def step(self):
-        item = None
-        if self.todo:
-            item = self.todo[-1]
-        self.todo.pop()
-
-        if (item[0] == "node"):
-            self.AddNode(*item[1:])
-        elif (item[0] == "edge"):
-            self.AddEdge(item[1])
-        else:
-            print("Error: Item/Tuple wasn't a \"node\" or \"edge\" ")
-            sys.exit(1) 
+        self.todo.pop().apply(self)
 
-    def AddNode(self, pos, expansion, i, j):
+    def AddNode(self, pos, expansion, i, j, score=0.0):
         if (pos, i, j) in self.chart:
             existing = self.chart[(pos, i, j)]
-            existing.add(expansion)
+            if not existing.add(expansion, score) and self.stats:
+                self.stats.duplicates += 1
         else:
-            node = Node(pos, expansion, i, j)
+            node = Node(pos, expansion, i, j, score)
             self.chart[(pos, i, j)] = node
-            self.start(node)
-            self.combine(node)
+            diff = self.cover(node) if self.pack else None
+            self.start(node, diff)
+            self.combine(node, diff)
+
+    def cover(self, node):
+        # Pack mode: looks for a node added earlier over the same span whose
+        # category subsumes node's.  Rules and edges that ignore every
+        # position where the two differ (see care_positions) treat them
+        # alike, so node takes over what they built from the covering node,
+        # with the same bindings, instead of being unified with them again;
+        # its copies of incomplete edges merge with the originals in
+        # AddEdge.  Returns those positions, for start and combine to skip
+        # the same rules and edges; None if nothing covers node.
+        key = (node.cat[0], node.i)
+        others = self.spans.get(key)
+        if others is None:
+            others = self.spans[key] = []
+        others.append(node)
+
+        star = STAR if self.grammar.compiled else '*'
+        cat = node.cat
+        for other in others[:-1]:
+            x = other.cat
+            if len(x) == len(cat) and all(u == v or u == star
+                                          for (u, v) in zip(x[1:], cat[1:])):
+                diff = frozenset(i for i in range(1, len(cat)) if x[i] != cat[i])
+                for edge in self.derived.get(other, ()):
+                    if diff.isdisjoint(care_positions(self.grammar, edge.rule, edge.dot - 1)):
+                        if edge.prev is None:
+                            copy = Edge(edge.rule, [node], edge.bindings)
+                        else:
+                            copy = edge.prev.advance(node, edge.bindings)
+                        self.ToAdd(EdgeItem(copy))
+                if self.stats:
+                    self.stats.packed_nodes += 1
+                return diff
+        return None
+
+    def derive(self, node, edge):
+        # Pack mode: remembers the edges built from node, see cover
+        if self.pack:
+            self.derived.setdefault(node, []).append(edge)
+        self.ToAdd(EdgeItem(edge))
 
     def AddEdge(self, edge):
         afterdot = edge.afterdot()
         if afterdot:
+            # An equivalent edge reached through another derivation is
+            # packed into the first instead of waiting beside it.  Both end
+            # at the current position, so nothing has been combined with
+            # the first yet and the merge is seen by everything built on it.
             j = edge.end()
+            signature = (edge.rule, edge.dot, edge.i, j, edge.bindings)
+            first = self.seen.get(signature)
+            if first is not None:
+                first.merge(edge)
+                if self.stats:
+                    self.stats.merged_edges += 1
+                return
+            self.seen[signature] = edge
+
+            if not (j, afterdot[0]) in self.edges.map:
+                self.expected.add(j, afterdot[0])
             self.edges.add((j, afterdot[0]), edge)
         else:
-            assert(len(edge.expansion) == len(edge.rule.rhs))
             self.complete(edge)   
             
     def shift(self, j):
+        self.seen = {}
+        self.spans = {}
+        self.derived = {}
         word = self.words[j - 1]
         parts = self.grammar.lexicon.parts(word)
+        lexicon = self.grammar.lexicon
         for pos in parts:
-            self.ToAdd(("node", pos, word, j-1, j))
-
-    def start(self, node):
-        assert(isinstance(node.cat[0], str))
-        for rule in self.grammar.continuations(node.cat[0]):
+            self.ToAdd(NodeItem(pos, word, j-1, j, lexicon.score(word, pos)))
+
+    def allowed(self, i):
+        # Heads a new constituent starting at i could usefully have: left
+        # corners of whatever edges ending at i expect, or of the start
+        # symbol at 0.  Every edge ending at i is in place before the first
+        # node starting at i arrives, so the set is computed once.
+        allowed = self.allowed_at.get(i)
+        if allowed is None:
+            lc = self.grammar.lc
+            wanted = self.expected[i]
+            if i == 0:
+                wanted = wanted + [self.grammar.start[0]]
+
+            allowed = set()
+            for head in wanted:
+                allowed.update(lc.get(head, (head,)))
+            self.allowed_at[i] = allowed
+
+        return allowed
+
+    def viable(self, rule, dot, j):
+        # One word of lookahead: the word after j must be able to begin the
+        # next RHS category, and an incomplete edge cannot end the sentence.
+        if dot == len(rule.rhs):
+            return True
+        if j >= len(self.words):
+            return not self.final
+
+        heads = self.lookahead.get(j)
+        if heads is None:
+            parts = self.grammar.lexicon.parts(self.words[j])
+            heads = self.lookahead[j] = set(pos[0] for pos in parts)
+
+        head = rule.rhs[dot][0]
+        return not heads.isdisjoint(self.grammar.lc.get(head, (head,)))
+
+    def start(self, node, diff=None):
+        # diff: see cover
+        if self.prune:
+            allowed = self.allowed(node.i)
+
+        for rule in self.grammar.starts(node.cat):
+            if self.prune and not (rule.lhs[0] in allowed and
+                                   self.viable(rule, 1, node.j)):
+                continue
+            if diff is not None and diff.isdisjoint(care_positions(self.grammar, rule, 0)):
+                continue
 
-            query = unify(rule.rhs[0], node.cat, rule.bindings)
+            query = self.unify(rule.plans[0], node.cat, rule.bindings)
             
             if query != None:
-                self.ToAdd(("edge", Edge(rule, [node], query)))
+                self.derive(node, Edge(rule, [node], query))
 
-    def combine(self, node):
-        edges = self.edges[(node.i, node.cat[0])]
+    def combine(self, node, diff=None):
+        key = (node.i, node.cat[0])
+        edges = self.edges[key]
+        if len(edges) >= INDEX_MIN_EDGES:
+            edges = self.indexed(key, edges, node.cat)
         for edge in edges:
-            if edge.afterdot()[0] == node.cat[0] and edge.end() == node.i:
-                query = unify(edge.afterdot(), node.cat, edge.bindings)
-                edge = edge + node
-                if query != None:
-                    edge.bindings = query
-                    self.ToAdd(("edge", edge))
-                
-                assert(isinstance(edge, Edge))
+            dot = edge.dot
+            if self.prune and not self.viable(edge.rule, dot + 1, node.j):
+                continue
+            if diff is not None and diff.isdisjoint(care_positions(self.grammar,
+                                                                   edge.rule, dot)):
+                continue
+
+            query = self.unify(edge.rule.plans[dot], node.cat, edge.bindings)
+            if query != None:
+                self.derive(node, edge.advance(node, query))
                 
+    def indexed(self, key, edges, cat):
+        # The edges at key whose category after the dot, with the variables
+        # the edge has bound taken as constants, can unify with cat; the
+        # index catches up with the edges added since it was last used
+        index = self.edge_indexes.get(key)
+        if index is None:
+            index = self.edge_indexes[key] = FeatureIndex(edges[0].rule.plans[0][1])
+        for edge in edges[len(index):]:
+            (n, star, checks, binds) = edge.rule.plans[edge.dot]
+            b = edge.bindings
+            index.add(edge, n, checks + tuple((i, b[k]) for (i, k) in binds
+                                              if b[k] != star))
+        return index.candidates(cat)
+
     def complete(self,e):
         assert(isinstance(e, Edge))
-        cat = subst(e.bindings, e.rule.lhs)
-        i = e.expansion[0].i
-        j = e.expansion[-1].j
-        self.ToAdd(("node", cat, e.expansion, i, j))
+        cat = instantiate(e.rule.lhs, e.rule.slots, e.bindings)
+        for expansion in e.expansions():
+            score = e.rule.score + sum(node.score for node in expansion)
+            self.ToAdd(NodeItem(cat, expansion, e.i, e.node.j, score))
+
+
+class ParserStats:
+    # Counters and per-phase wall time (seconds) for one parse
+    PHASES = ('shift', 'start', 'combine', 'complete')
+
+    def __init__(self, words):
+        self.words = len(words)
+        self.calls = dict.fromkeys(self.PHASES, 0)
+        self.time = dict.fromkeys(self.PHASES, 0.0)
+        self.unify_attempts = 0
+        self.unify_successes = 0
+        self.nodes = 0
+        self.edges = 0
+        self.duplicates = 0
+        self.merged_edges = 0
+        self.packed_nodes = 0
+        self.agenda_max = 0
+        self.total_time = 0.0
+        self.rules = {}
+        # set when the chart came from a ResultCache and nothing was parsed
+        self.cache_hit = False
+
+    def as_dict(self):
+        return {'words': self.words,
+                'calls': dict(self.calls),
+                'time': dict(self.time),
+                'unify_attempts': self.unify_attempts,
+                'unify_successes': self.unify_successes,
+                'nodes': self.nodes,
+                'edges': self.edges,
+                'duplicates': self.duplicates,
+                'merged_edges': self.merged_edges,
+                'packed_nodes': self.packed_nodes,
+                'agenda_max': self.agenda_max,
+                'total_time': self.total_time,
+                'rules': dict((repr(rule), n) for (rule, n) in self.rules.items()),
+                'cache_hit': self.cache_hit}
+
+    def __repr__(self):
+        return '<ParserStats %r>' % self.as_dict()
+
+
+def timed(phase):
+    def wrap(method):
+        def timed_method(self, *args):
+            start = time.perf_counter()
+            try:
+                return method(self, *args)
+            finally:
+                self.stats.calls[phase] += 1
+                self.stats.time[phase] += time.perf_counter() - start
+        return timed_method
+    return wrap
+
+
+class StatsChart(Chart):
+    # A Chart that fills in a ParserStats as it goes.  Kept apart so that
+    # parsing without stats pays nothing for them.
+    def __init__(self, parser, words, final=True):
+        Chart.__init__(self, parser, words, final)
+        self.stats = ParserStats(words or [])
+        self.unify = self.counted_unify
+
+    def run(self, begin=0):
+        start = time.perf_counter()
+        root = Chart.run(self, begin)
+        self.stats.total_time = time.perf_counter() - start
+        self.stats.nodes = len(self.chart)
+        return root
+
+    def counted_unify(self, plan, y, b):
+        self.stats.unify_attempts += 1
+        query = unify_plan(plan, y, b)
+        if query is not None:
+            self.stats.unify_successes += 1
+        return query
 
-def cross_product(items):
-    product = [tuple()]
+    def ToAdd(self, item):
+        Chart.ToAdd(self, item)
+        if len(self.todo) > self.stats.agenda_max:
+            self.stats.agenda_max = len(self.todo)
 
-    for row in items:
-        new_products = []
-        for a in product:
-            for b in row:
-                new_products.append((*a, b))
-        product = new_products
+    def AddEdge(self, edge):
+        self.stats.edges += 1
+        self.stats.rules[edge.rule] = self.stats.rules.get(edge.rule, 0) + 1
+        Chart.AddEdge(self, edge)
 
-    return product
+    shift = timed('shift')(Chart.shift)
+    start = timed('start')(Chart.start)
+    combine = timed('combine')(Chart.combine)
+    complete = timed('complete')(Chart.complete)
 
-def tree_expansions(node_exps):
-    choices = [n.trees() for n in node_exps]
-    return cross_product(choices)
+
+class Split:
+    # Binarization of a rule A -> B0 B1 ... Bn: X1 -> B0 B1, Xd -> Xd-1 Bd,
+    # A -> Xn-1 Bn.  Split(rule, d) is Xd-1, which has matched B0 ... Bd-1
+    # and combines with a Bd to its right.  Its features are the rule's
+    # bindings, so the variables stay consistent across the pieces.
+    __slots__ = ('rule', 'dot', 'plan', 'head', 'next')
+
+    def __init__(self, rule, dot):
+        self.rule = rule
+        self.dot = dot
+        self.plan = rule.plans[dot]
+        self.head = rule.rhs[dot][0]
+        self.next = None
+        if dot + 1 < len(rule.rhs):
+            self.next = Split(rule, dot + 1)
+
+    def __repr__(self):
+        return '<Split %r at %d>' % (self.rule, self.dot)
+
+
+class BinarizedGrammar:
+    # The grammar as seen by the CKY engine: starts(cat) is the rules whose
+    # first RHS category can unify with cat, each with its first Split (None
+    # for unary rules).  Every category (or Split with its bindings) a chart meets
+    # is interned to a bit, so that the categories over a span are one int
+    # and "is there a B here" is a mask with the bits of all cats headed B.
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self.version = grammar.version
+        self.first = dict((rule, Split(rule, 1)) for rule in grammar.rules()
+                          if len(rule.rhs) > 1)
+        self.memo = {}
+
+        self.ids = {}
+        self.keys = []
+        self.heads = {}
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        return self.grammar
+
+    def __setstate__(self, grammar):
+        self.__init__(grammar)
+
+    def starts(self, cat):
+        starts = self.memo.get(cat)
+        if starts is None:
+            starts = self.memo[cat] = [(rule, self.first.get(rule))
+                                       for rule in self.grammar.starts(cat)]
+        return starts
+
+    def intern(self, key):
+        # key is a category, or a (Split, bindings) pair.  Interning happens
+        # while parsing, so concurrent charts share the table under a lock;
+        # the id is published last, after the head mask includes it.
+        i = self.ids.get(key)
+        if i is None:
+            with self.lock:
+                i = self.ids.get(key)
+                if i is None:
+                    i = len(self.keys)
+                    self.keys.append(key)
+                    if not isinstance(key[0], Split):
+                        self.heads[key[0]] = self.heads.get(key[0], 0) | (1 << i)
+                    self.ids[key] = i
+        return i
+
+
+
+class CKYChart(Chart):
+    # Fills the chart CKY-style over the binarized grammar, one column (end
+    # position) at a time, instead of through an agenda of edges.  cells[j]
+    # and splits[j] map each start i to the bitsets of the categories and
+    # of the partly matched rules over (i, j); partials holds, for each
+    # Split over a span, the
+    # child sequences it has matched and their scores.  Nodes end up in
+    # self.chart just as with the agenda engine, so trees, counts and kbest
+    # are read out the same way.
+    def __init__(self, parser, words, final=True):
+        Chart.__init__(self, parser, words, final)
+        self.tables = parser.binarized()
+        self.cells = {}
+        self.splits = {}
+        self.partials = {}
+
+    def run(self, begin=0):
+        if begin == 0 and self.grammar.lexicon.unknown(self.words):
+            self.rejected = True
+            return None
+
+        for j in range(begin + 1, len(self.words) + 1):
+            self.column(j)
+        return self.root()
+
+    def feed(self, word):
+        self.words.append(word)
+        self.column(len(self.words))
+        return self.root() is not None
+
+    def partial_state(self):
+        # The Splits ending at the last word, as the Edges the agenda engine
+        # holds for them: one per Split and bindings, with every child
+        # sequence matched so far merged in
+        j = len(self.words)
+        keys = self.tables.keys
+        edges = []
+        for (i, splits) in self.splits.get(j, {}).items():
+            for s in bits(splits):
+                (split, b) = keys[s]
+                partials = self.partials[(s, i, j)]
+                edge = Edge(split.rule, partials[0][0], b)
+                for (nodes, score) in partials[1:]:
+                    edge.merge(Edge(split.rule, nodes, b))
+                edges.append(edge)
+        return edges
+
+    def restore(self, other, m):
+        Chart.restore(self, other, m)
+        self.cells = dict((j, cells) for (j, cells) in other.cells.items() if j <= m)
+        self.splits = dict((j, splits) for (j, splits) in other.splits.items() if j <= m)
+        self.partials = dict((key, partials) for (key, partials) in other.partials.items()
+                             if key[2] <= m)
+
+    def size(self):
+        return 200 * len(self.chart) + 100 * sum(map(len, self.partials.values()))
+
+    def column(self, j):
+        word = self.words[j - 1]
+        lexicon = self.grammar.lexicon
+        column = self.cells[j] = {}
+        self.splits[j] = {}
+        for pos in lexicon.parts(word):
+            self.add(pos, word, j - 1, j, lexicon.score(word, pos))
+        self.close(j - 1, j)
+
+        keys = self.tables.keys
+        heads = self.tables.heads
+        (chart, partials, unify) = (self.chart, self.partials, self.unify)
+        for i in range(j - 2, -1, -1):
+            # only the cells (k, j) with k > i are complete; (i, j) is filling
+            for (k, cell) in list(column.items()):
+                splits = self.splits[k].get(i)
+                if k <= i or not splits:
+                    continue
+
+                for s in bits(splits):
+                    (split, b) = keys[s]
+                    for c in bits(cell & heads.get(split.head, 0)):
+                        cat = keys[c]
+                        query = unify(split.plan, cat, b)
+                        if query is not None:
+                            self.extend(split, query, partials[(s, i, k)],
+                                        chart[(cat, k, j)], i, j)
+            if i in column:
+                self.close(i, j)
+
+    def extend(self, split, bindings, partials, right, i, j):
+        rule = split.rule
+        if self.prune and not self.viable(rule, split.dot + 1, j):
+            return
+        if split.next is None:
+            cat = instantiate(rule.lhs, rule.slots, bindings)
+            for (nodes, score) in partials:
+                self.add(cat, nodes + (right,), i, j, score + right.score)
+        else:
+            extended = [(nodes + (right,), score + right.score)
+                        for (nodes, score) in partials]
+            self.add_split(split.next, bindings, i, j, extended)
+
+    def add(self, cat, expansion, i, j, score):
+        node = self.chart.get((cat, i, j))
+        if node is not None:
+            node.add(expansion, score)
+            return None
+
+        node = self.chart[(cat, i, j)] = Node(cat, expansion, i, j, score)
+        column = self.cells[j]
+        column[i] = column.get(i, 0) | (1 << self.tables.intern(cat))
+        return node
+
+    def add_split(self, split, bindings, i, j, partials):
+        s = self.tables.intern((split, bindings))
+        key = (s, i, j)
+        if key in self.partials:
+            self.partials[key].extend(partials)
+        else:
+            self.partials[key] = partials
+            column = self.splits[j]
+            column[i] = column.get(i, 0) | (1 << s)
+            if split.head not in self.expected[j]:
+                self.expected.add(j, split.head)
+
+    def close(self, i, j):
+        # Unary rules to a fixed point over the span, and the first step of
+        # every longer rule, for each category found.  Columns are filled
+        # left to right, so the Splits ending at i are all in place and the
+        # agenda engine's left-corner and lookahead filters apply unchanged.
+        if self.prune:
+            allowed = self.allowed(i)
+        keys = self.tables.keys
+        usable = {}
+        todo = [self.chart[(keys[c], i, j)] for c in bits(self.cells[j][i])]
+        while todo:
+            node = todo.pop()
+            rules = usable.get(node.cat)
+            if rules is None:
+                rules = self.tables.starts(node.cat)
+                if self.prune:
+                    rules = [(rule, split) for (rule, split) in rules
+                             if rule.lhs[0] in allowed and self.viable(rule, 1, j)]
+                usable[node.cat] = rules
+
+            for (rule, split) in rules:
+                query = self.unify(rule.plans[0], node.cat, rule.bindings)
+                if query is None:
+                    continue
+                score = rule.score + node.score
+                if split is None:
+                    cat = instantiate(rule.lhs, rule.slots, query)
+                    new = self.add(cat, (node,), i, j, score)
+                    if new is not None:
+                        todo.append(new)
+                else:
+                    self.add_split(split, query, i, j, [((node,), score)])
+
+
+class LRUCache:
+    # A thread-safe cache bounded by number of entries and by approximate
+    # bytes (as given to put).  policy is 'lru', or 'fifo' to evict in
+    # insertion order regardless of use.
+    def __init__(self, max_entries=256, max_bytes=None, policy='lru'):
+        assert(policy in ('lru', 'fifo'))
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.on_evict = None
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.entries = collections.OrderedDict()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            if self.policy == 'lru':
+                self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, value, size=0):
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+
+            while self.entries and (
+                    (self.max_entries is not None and len(self.entries) > self.max_entries) or
+                    (self.max_bytes is not None and self.bytes > self.max_bytes)):
+                (old, (value, size)) = self.entries.popitem(last=False)
+                self.bytes -= size
+                if self.on_evict:
+                    self.on_evict(old)
+
+    def __getstate__(self):
+        # a copy (e.g. in a worker process) starts out empty
+        return (self.max_entries, self.max_bytes, self.policy)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+def grammar_key(grammar):
+    return (id(grammar), grammar.version)
+
+
+class ResultCache:
+    # Filled charts (the packed forest, not just trees) of recent sentences,
+    # keyed by the words and the options of the parser that filled them (see
+    # Parser.options), so that one cache can be shared by parsers set up
+    # differently.  Emptied whenever the grammar is reloaded.
+    def __init__(self, max_entries=1024, max_bytes=64 * 2**20, policy='lru'):
+        self.charts = LRUCache(max_entries, max_bytes, policy)
+        self.grammar = None
+
+    @property
+    def hits(self):
+        return self.charts.hits
+
+    @property
+    def misses(self):
+        return self.charts.misses
+
+    def check(self, grammar):
+        if grammar_key(grammar) != self.grammar:
+            self.charts.clear()
+            self.grammar = grammar_key(grammar)
+
+    def lookup(self, grammar, words, options=()):
+        self.check(grammar)
+        return self.charts.get((tuple(words), options))
+
+    def store(self, grammar, chart, options=()):
+        self.check(grammar)
+        self.charts.put((tuple(chart.words), options), chart, chart.size())
+
+    def __getstate__(self):
+        return self.charts.__getstate__()
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+class PrefixCache:
+    # Filled charts of recent sentences, looked up by the longest prefix
+    # they share with a new sentence so that parsing resumes after it.
+    def __init__(self, max_entries=256, max_bytes=None, policy='lru'):
+        self.charts = LRUCache(max_entries, max_bytes, policy)
+        self.charts.on_evict = self.evicted
+        self.prefixes = {}
+        self.grammar = None
+
+    def check(self, grammar):
+        if grammar_key(grammar) != self.grammar:
+            self.charts.clear()
+            self.prefixes = {}
+            self.grammar = grammar_key(grammar)
+
+    def find(self, words):
+        # The cached chart sharing the longest prefix with words, and the
+        # length of that prefix; (None, 0) if there is none.
+        with self.charts.lock:
+            for m in range(len(words), 0, -1):
+                key = self.prefixes.get(tuple(words[:m]))
+                if key is not None:
+                    break
+            else:
+                return (None, 0)
+        chart = self.charts.get(key)
+        if chart is None:
+            return (None, 0)
+        return (chart, m)
+
+    def store(self, chart):
+        key = tuple(chart.words)
+        self.charts.put(key, chart, chart.size())
+        with self.charts.lock:
+            if key in self.charts:
+                for m in range(1, len(key) + 1):
+                    self.prefixes[key[:m]] = key
+
+    def evicted(self, key):
+        for m in range(1, len(key) + 1):
+            if self.prefixes.get(key[:m]) == key:
+                del self.prefixes[key[:m]]
+
+    def __getstate__(self):
+        return self.charts.__getstate__()
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+class Parser():
+    # Holds the grammar and options only; all per-sentence state lives in a
+    # Chart.  self.state is the chart used by the step-by-step interface
+    # (reset, shift, step).
+    def __init__(self, grammar, prune=True, stats=False, on_stats=None,
+                 agenda='stack', first=False, prefix_cache=None,
+                 result_cache=None, engine='agenda', pack=False):
+        # stats: collect a ParserStats per parse, kept in self.stats after
+        # each call; on_stats, if given, is called with it as well
+        # agenda: 'stack', 'fifo', 'span', 'score' or a factory for an agenda
+        # first: stop at the first complete parse of the input
+        # prefix_cache: a PrefixCache (or True for a default one) to resume
+        # parsing from charts of earlier sentences sharing a prefix
+        # result_cache: a ResultCache (or True for a default one) to reuse
+        # the charts of sentences seen before
+        # engine: 'agenda', or 'cky' to fill a CKYChart over the binarized
+        # grammar; CKY ignores agenda and first, and collects no stats
+        # pack: pack nodes into more general ones over the same span where
+        # the rules using them cannot tell them apart; see Chart.cover
+        assert(engine in ('agenda', 'cky'))
+        assert(engine == 'agenda' or not (stats or on_stats)), \
+            "the cky engine collects no stats"
+        self.grammar = grammar
+        self.engine = engine
+        self.pack = pack
+        self.tables = None
+        self.prune = prune
+        self.agenda = AGENDAS.get(agenda, agenda)
+        self.first = first
+        self.collect_stats = stats or on_stats is not None
+        self.on_stats = on_stats
+        self.stats = None
+        if prefix_cache is True:
+            prefix_cache = PrefixCache()
+        self.prefix_cache = prefix_cache
+        if result_cache is True:
+            result_cache = ResultCache()
+        self.result_cache = result_cache
+        self.state = self.new_chart(None)
+
+    def __getstate__(self):
+        # The step-by-step state is left behind, e.g. when the parser is
+        # handed to the workers of parse_many
+        state = self.__dict__.copy()
+        state['state'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.state = self.new_chart(None)
+
+    def refresh(self):
+        # a compiled grammar is recompiled once its source has been reloaded
+        if self.grammar.compiled:
+            self.grammar.refresh()
+
+    def new_chart(self, words, final=True):
+        self.refresh()
+        if self.engine == 'cky':
+            return CKYChart(self, words, final)
+        if self.collect_stats:
+            return StatsChart(self, words, final)
+        return Chart(self, words, final)
+
+    def binarized(self):
+        # built on first use and again whenever the grammar is reloaded
+        tables = self.tables
+        if tables is None or tables.version != self.grammar.version:
+            tables = self.tables = BinarizedGrammar(self.grammar)
+        return tables
+
+    def resume(self, chart):
+        # Restores chart from the cached chart sharing the longest prefix
+        # with it and returns how many words that covers.  With lookahead
+        # pruning the edges ending at m were filtered on word m + 1, so that
+        # word must be shared too.  The last position of a cached chart is
+        # never reused: it was pruned as the end of the input, or cut short
+        # by first=True.
+        words = chart.words
+        (cached, m) = self.prefix_cache.find(words)
+        if cached is None:
+            return 0
+
+        if self.prune:
+            m -= 1
+        m = min(m, len(cached.words) - 1)
+        if m <= 0:
+            return 0
+
+        chart.restore(cached, m)
+        return m
+
+    def incremental(self):
+        # A chart to feed() words into one at a time
+        return self.new_chart([], final=False)
+
+    @property
+    def chart(self):
+        return self.state.chart
+
+    @property
+    def edges(self):
+        return self.state.edges
+
+    @property
+    def todo(self):
+        return self.state.todo
+
+    @property
+    def words(self):
+        return self.state.words
+
+    def reset(self, words):
+        self.state = self.new_chart(words)
+
+    def shift(self, j):
+        self.state.shift(j)
+
+    def step(self):
+        self.state.step()
+
+    def __call__(self, words, limit=None):
+        return list(self.iterparse(words, limit))
+
+    async def aparse(self, words, limit=None, executor=None):
+        # Parses in an executor (the loop's default thread pool unless one
+        # is given) so an asyncio server is not blocked.  asyncio and
+        # multiprocessing are imported where used: they dominate import time.
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self, words, limit)
+
+    def iterparse(self, words, limit=None):
+        return self.fill(words).itertrees(limit)
+
+    def parse_many(self, sentences, workers=None, limit=None, chunksize=1):
+        # Parse many sentences over a process pool.  The parser (and so the
+        # loaded grammar) is handed to each worker once, when it starts.
+        # Results are yielded in input order as soon as they are ready.
+        sentences = (s.split() if isinstance(s, str) else s for s in sentences)
+        if workers == 1:
+            for words in sentences:
+                yield self(words, limit)
+            return
+
+        import multiprocessing
+        with multiprocessing.Pool(workers, init_worker, (self, limit)) as pool:
+            for trees in pool.imap(parse_in_worker, sentences, chunksize):
+                yield trees
+
+    def kbest(self, words, k):
+        return self.fill(words).kbest(k)
+
+    def count(self, words):
+        node = self.parse(words)
+        if node is None:
+            return 0
+        return node.count()
+
+    def parse(self, words):
+        return self.fill(words).root()
+
+    def options(self):
+        # what a filled chart depends on besides the grammar and the words
+        return (self.engine, self.prune, self.first, self.agenda, self.pack)
+
+    def fill(self, words):
+        self.refresh()
+        if self.result_cache is not None:
+            chart = self.result_cache.lookup(self.grammar, words, self.options())
+            if chart is not None:
+                if self.collect_stats:
+                    stats = ParserStats(words)
+                    stats.cache_hit = True
+                    self.report(stats)
+                return chart
+
+        # the chart may outlive this call in a cache, so it gets its own list
+        chart = self.new_chart(list(words))
+        if self.prefix_cache is None:
+            chart.run()
+        else:
+            self.prefix_cache.check(self.grammar)
+            chart.run(self.resume(chart))
+            if not chart.rejected:
+                self.prefix_cache.store(chart)
+
+        if self.result_cache is not None:
+            self.result_cache.store(self.grammar, chart, self.options())
+        if chart.stats:
+            self.report(chart.stats)
+        return chart
+
+    def report(self, stats):
+        self.stats = stats
+        if self.on_stats:
+            self.on_stats(stats)
+
+worker = None
+
+def init_worker(parser, limit):
+    global worker
+    worker = (parser, limit)
+
+def parse_in_worker(words):
+    (parser, limit) = worker
+    return parser(words, limit)
+
+
+def iter_expansions(nodes):
+    # Lazily walk the cross product of the children's trees; the first child
+    # varies slowest, and only one tree per child is alive at a time.
+    if not nodes:
+        yield ()
+        return
+
+    for first in nodes[0].itertrees():
+        for rest in iter_expansions(nodes[1:]):
+            yield (first,) + rest
+
+
+class KBest:
+    # Lazy k-best extraction over the packed chart (Huang & Chiang 2005,
+    # algorithm 3).  Derivations of a node are produced in score order only
+    # as far as they are asked for, so the work grows with k rather than
+    # with the number of trees.  A derivation is (score, e, ranks): the
+    # index of the expansion used and the rank taken from each child.
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self.derivs = {}
+        self.cands = {}
+        self.seen = {}
+        self.weights = {}
+
+    def best(self, node, k):
+        result = []
+        for rank in range(k):
+            d = self.kth(node, rank)
+            if d is None:
+                break
+            result.append((d[0], self.tree(node, rank)))
+        return result
+
+    def weight(self, node, e):
+        key = (node, e)
+        if key not in self.weights:
+            exp = node.expansions[e]
+            if isinstance(exp, str):
+                w = self.grammar.lexicon.score(exp, node.cat)
+            else:
+                w = self.grammar.score(node.cat, [c.cat for c in exp])
+            self.weights[key] = w or 0.0
+        return self.weights[key]
+
+    def candidate(self, node, e, ranks):
+        score = self.weight(node, e)
+        exp = node.expansions[e]
+        if not isinstance(exp, str):
+            for (child, rank) in zip(exp, ranks):
+                d = self.kth(child, rank)
+                if d is None:
+                    return None
+                score += d[0]
+        return (-score, e, ranks)
+
+    def kth(self, node, k):
+        derivs = self.derivs.get(node)
+        if derivs is None:
+            derivs = self.derivs[node] = []
+            self.seen[node] = set()
+            heap = self.cands[node] = []
+            for (e, exp) in enumerate(node.expansions):
+                ranks = () if isinstance(exp, str) else (0,) * len(exp)
+                self.seen[node].add((e, ranks))
+                cand = self.candidate(node, e, ranks)
+                if cand is not None:
+                    heap.append(cand)
+            heapq.heapify(heap)
+
+        heap = self.cands[node]
+        while len(derivs) <= k:
+            if derivs:
+                self.successors(node, derivs[-1])
+            if not heap:
+                return None
+            (neg, e, ranks) = heapq.heappop(heap)
+            derivs.append((-neg, e, ranks))
+
+        return derivs[k]
+
+    def successors(self, node, d):
+        (score, e, ranks) = d
+        for p in range(len(ranks)):
+            next_ranks = ranks[:p] + (ranks[p] + 1,) + ranks[p + 1:]
+            if (e, next_ranks) in self.seen[node]:
+                continue
+            self.seen[node].add((e, next_ranks))
+            cand = self.candidate(node, e, next_ranks)
+            if cand is not None:
+                heapq.heappush(self.cands[node], cand)
+
+    def tree(self, node, k):
+        (score, e, ranks) = self.derivs[node][k]
+        exp = node.expansions[e]
+        if isinstance(exp, str):
+            return Tree(node.cat, word=exp)
+        return Tree(node.cat, tuple(self.tree(child, rank)
+                                    for (child, rank) in zip(exp, ranks)))
+
+
+def expansion_key(expansion):
+    # A word, or the tuple of child nodes; nodes are unique within a chart,
+    # so they hash by identity.
+    if isinstance(expansion, str):
+        return expansion
+    return tuple(expansion)
 
 
 class Node:
-    def __init__(self, cat, item, i, j):
+    __slots__ = ('cat', 'i', 'j', 'expansions', 'keys', 'score')
+
+    def __init__(self, cat, item, i, j, score=0.0):
         self.cat = cat
         self.i = i
         self.j = j
         self.expansions = [item]
-
-    def add(self, expansion):
-        if not(expansion in self.expansions):
-            self.expansions.append(expansion)
-
-    def trees(self):
-        return list(self.itertrees())
-
-    def itertrees(self):
+        self.keys = {expansion_key(item)}
+        # best inside score seen so far, used to order a score agenda
+        self.score = score
+
+    def add(self, expansion, score=0.0):
+        # self.keys mirrors self.expansions so that duplicates are found
+        # by hashing instead of comparing against every expansion
+        if score > self.score:
+            self.score = score
+        key = expansion_key(expansion)
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        self.expansions.append(expansion)
+        return True
+
+    def count(self, memo=None):
+        # Number of trees below this node, by dynamic programming over the
+        # packed expansions; each node is visited once per memo.
+        if memo is None:
+            memo = {}
+        if self in memo:
+            return memo[self]
+
+        total = 0
+        for e in self.expansions:
+            if isinstance(e, str):
+                total += 1
+            else:
+                product = 1
+                for child in e:
+                    product *= child.count(memo)
+                    if not product:
+                        break
+                total += product
+
+        memo[self] = total
+        return total
+
+    def trees(self, limit=None):
+        return list(self.itertrees(limit))
+
+    def itertrees(self, limit=None):
+        trees = self._itertrees()
+        if limit is not None:
+            trees = itertools.islice(trees, limit)
+        return trees
+
+    def _itertrees(self):
         for e in self.expansions:
             if isinstance(e, str):
                 yield Tree(self.cat, word=e)
             else:
-                for childlist in tree_expansions(e):
+                for childlist in iter_expansions(e):
                     yield Tree(self.cat, childlist)
 
     def __repr__(self):
@@ -405,37 +2262,37 @@ class Node:
         return '[' + " ".join([str(self.i), str(self.cat), str(self.j)]) + ']'
 
 
-x = Category(["V", 0, 'i', '0'])
-print(x)
-
-y = tokenize("V.$f.i.0")
-print(y)
 
-y = "V.$f.i.0".split('.')
-print(y)
+def demo():
+    x = Category(["V", 0, 'i', '0'])
+    print(x)
 
-z = parse_category("V.$f.i.0")
-print(z)
+    y = tokenize("V.$f.i.0")
+    print(y)
 
-t = {}
-z = parse_category("V.$f.i.$x", t)
-print(z)
+    y = "V.$f.i.0".split('.')
+    print(y)
 
-print(t)
+    z = parse_category("V.$f.i.0")
+    print(z)
 
+    t = {}
+    z = parse_category("V.$f.i.$x", t)
+    print(z)
 
-if meet("a", "*") != "a":
-    print ("Error. Expected \"a\". Got:" + meet("a", "*"))
+    print(t)
 
-if meet("*", "b") != "b":
-    print ("Error. Expected \"b\". Got:" + meet("*", "b"))
+    if meet("a", "*") != "a":
+        print ("Error. Expected \"a\". Got:" + meet("a", "*"))
 
-if meet("*", "*") != "*":
-    print ("Error. Expected \"*\". Got:" + meet("*", "*"))
+    if meet("*", "b") != "b":
+        print ("Error. Expected \"b\". Got:" + meet("*", "b"))
 
-if meet("a", "b") != None:
-    print ("Error. Expected \"None\". Got:" + meet("a", "*"))
+    if meet("*", "*") != "*":
+        print ("Error. Expected \"*\". Got:" + meet("*", "*"))
 
+    if meet("a", "b") != None:
+        print ("Error. Expected \"None\". Got:" + meet("a", "*"))
 
 # Test Parse
 # t={}
@@ -485,3 +2342,5 @@ if meet("a", "b") != None:
 # x = p('Tuna is a cat'.split())
 # print (x[0])
 
+if __name__ == '__main__':
+    demo()
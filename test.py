@@ -19,8 +19,10 @@ if ac < len(sys.argv):
 
 fg0 = os.path.join(gdir, 'fg0')
 fg1 = os.path.join(gdir, 'fg1')
+fg2 = os.path.join(gdir, 'fg2')
 
-for fn in (fg0 + '.g', fg0 + '.lex', fg1 + '.g', fg1 + '.lex', fg1 + '.sents'):
+for fn in (fg0 + '.g', fg0 + '.lex', fg1 + '.g', fg1 + '.lex', fg1 + '.sents',
+           fg2 + '.g', fg2 + '.lex'):
     if not os.path.exists(fn):
         raise Exception('Not found: %s' % fn)
 
@@ -92,6 +94,20 @@ test = Tester()
 with test('import parser'):
     import parser
 
+with test('import is silent and fast'):
+    import subprocess
+    code = ('import sys, time\n'
+            't = time.perf_counter()\n'
+            'import parser\n'
+            't = time.perf_counter() - t\n'
+            'sys.stderr.write("%f %d" % (t, "asyncio" in sys.modules))\n')
+    proc = subprocess.run([sys.executable, '-c', code], cwd=parser_dir,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    (seconds, asyncio_loaded) = proc.stderr.split()
+    test.eq((proc.stdout, asyncio_loaded), ('', '0'))
+    test.eq(float(seconds) < 0.5, True)
+
 with test('Category.__repr__'):
     cat = parser.Category(['X', 'y', 1, 0])
     test.eq(repr(cat), 'X.y.$1.$0')
@@ -192,6 +208,15 @@ with test('rule'):
 with test('rule'):
     test.eq(rule.rhs, [('V',0,'t',1), ('NP','*'), ('PP',1)])
 
+with test('unify_plan'):
+    plan = rule.plans[0]
+    for y in ('V.sg.t.*', 'V.*.t.to', 'V.sg.i.to', 'V.pl.t.on'):
+        for b in (('*', '*'), ('sg', '*'), ('*', 'to')):
+            test.eq(parser.unify_plan(plan, C(y), b), parser.unify(rule.rhs[0], C(y), b))
+
+with test('instantiate'):
+    test.eq(parser.instantiate(rule.lhs, rule.slots, ('sg', 'to')), C('VP.sg'))
+
 with test('rule.__repr__'):
     test.eq(repr(rule), 'VP.$0 -> V.$0.t.$1 NP.* PP.$1')
 
@@ -201,6 +226,37 @@ with test('continuations'):
 
 with test('load grammar'):
     g1 = parser.Grammar(fg1)
+
+with test('grammar cache'):
+    import shutil, tempfile
+    tmpdir = tempfile.mkdtemp()
+    for ext in ('.g', '.lex'):
+        shutil.copy(fg0 + ext, os.path.join(tmpdir, 'fg0' + ext))
+    tmp_fg0 = os.path.join(tmpdir, 'fg0')
+    gc = parser.Grammar(tmp_fg0, cache=True)
+    test.eq((gc.cache_hit, os.path.exists(tmp_fg0 + '.gcache')), (False, True))
+
+with test('grammar cache hit'):
+    gc = parser.Grammar(tmp_fg0, cache=True)
+    test.eq(gc.cache_hit, True)
+    test.eq([repr(r) for r in gc.continuations('V')], ['VP.$0 -> V.$0.i.0'])
+    test.eq(len(parser.Parser(gc)('these dogs bark'.split())), 1)
+
+with test('grammar cache invalidation'):
+    with open(tmp_fg0 + '.lex', 'a') as f:
+        f.write('cats N.pl\n')
+    gc = parser.Grammar(tmp_fg0, cache=True)
+    test.eq((gc.cache_hit, gc.lexicon.parts('cats')), (False, [C('N.pl')]))
+
+with test('grammar cache layout'):
+    # a cache written by another build of the parser is not used
+    (layout, parser.layout) = (parser.cache_layout(), 'other')
+    gc = parser.Grammar(tmp_fg0, cache=True)
+    parser.layout = layout
+    test.eq(gc.cache_hit, False)
+    test.eq(parser.Grammar(tmp_fg0, cache=True).cache_hit, False)
+    test.eq(parser.Grammar(tmp_fg0, cache=True).cache_hit, True)
+    shutil.rmtree(tmpdir)
     
 with test('continuations'):
     test.eq(sorted(repr(r) for r in g1.continuations('Aux')),
@@ -213,6 +269,35 @@ with test('g1.lexicon.parts'):
     test.eq(sorted(str(pos) for pos in g1.lexicon.parts('be')),
             ['Aux.base.enp', 'Aux.base.ing', 'Aux.base.pred'])
 
+with test('lexicon lookup'):
+    test.eq(g1.lexicon.lookup(['a', 'zzz']), [[C('Det.sg')], []])
+    test.eq(g1.lexicon.unknown('Nono owns a zzz'.split()), ['zzz'])
+
+with test('unknown word rejected'):
+    pu = parser.Parser(g1, stats=True)
+    test.eq(pu('every zzz is a weapon'.split()), [])
+    test.eq(pu.stats.calls['shift'], 0)
+
+with test('lexicon fallbacks'):
+    gf = parser.Grammar(fg1)
+    gf.lexicon.add_fallbacks(fold_case=True, suffixes=3)
+    test.eq(gf.lexicon.parts('Every'), [C('Det.sg')])
+    test.eq(gf.lexicon.parts('weapons'), [C('N.pl')])
+    test.eq(gf.lexicon.parts('zzz'), [])
+
+with test('lexicon fallbacks parse'):
+    pf = parser.Parser(gf)
+    ts = pf('Every American owns weapons'.split())
+    test.eq(len(ts), 1)
+    test.eq(parser.data_structs.terminal_string(ts[0]), 'Every American owns weapons')
+    test.eq(parser.Parser(gf.compile()).count('Every American owns weapons'.split()), 1)
+
+with test('compiled lexicon memoizes known words only'):
+    cl = gf.compile().lexicon
+    test.eq([len(cl.parts(word)) for word in ('Every', 'weapons', 'guns', 'zzz')],
+            [1, 1, 2, 0])
+    test.eq(sorted(cl.prts), ['weapons'])
+
 with test('Node'):
     if hasattr(parser, 'Node'): from parser import Node
     v = Node(C('V.sg.t.*'), 'chases', 2, 3)
@@ -220,6 +305,12 @@ with test('Node'):
     test.eq(v.i, 2)
     test.eq(v.j, 3)
 
+with test('node.add'):
+    n = Node(C('NP.sg'), [v], 0, 3)
+    test.eq((n.add([v]), n.add('chases'), n.add([v, v]), n.add('chases')),
+            (False, True, True, False))
+    test.eq(n.expansions, [[v], 'chases', [v, v]])
+
 with test('e.__str__'):
     e = parser.Edge(rule, [v], ('sg', '*'))
     test.eq(str(e), 'VP.$0 -> [2 V.sg.t.* 3] * NP.* PP.$1 : sg *')
@@ -227,6 +318,19 @@ with test('e.__str__'):
 with test('e.__repr__'):
     test.eq(repr(e), '<Edge VP.$0 -> [2 V.sg.t.* 3] * NP.* PP.$1 : sg *>')
 
+with test('e.advance'):
+    np = Node(C('NP.pl'), 'dogs', 3, 4)
+    e2 = e.advance(np, ('sg', '*'))
+    test.eq(str(e2), 'VP.$0 -> [2 V.sg.t.* 3] [3 NP.pl 4] * PP.$1 : sg *')
+    test.eq((e2.prev is e, e2.dot, e2.start(), e2.end()), (True, 2, 2, 4))
+
+with test('e.expansion'):
+    test.eq(e2.expansion, [v, np])
+    test.eq(parser.Edge(rule, [v, np], ('sg', '*')).expansion, [v, np])
+
+with test('slots'):
+    test.eq(hasattr(e2, '__dict__') or hasattr(v, '__dict__'), False)
+
 with test('p.reset'):
     p = parser.Parser(g0)
     p.reset('this dog barks'.split())
@@ -255,7 +359,7 @@ with test('parts'):
 
 with test('shift'):
     p.shift(1)
-    test.eq(list(p.todo), [('node', DetSg, 'this', 0, 1)])
+    test.eq(list(p.todo), [parser.NodeItem(DetSg, 'this', 0, 1)])
 
 with test('chart'):
     p.step()
@@ -263,7 +367,7 @@ with test('chart'):
 
 with test('step 1'):
     test.eq([repr(spec) for spec in p.todo],
-            ["('edge', <Edge NP.$0 -> [0 Det.sg 1] * N.$0 : sg>)"])
+            ["EdgeItem(<Edge NP.$0 -> [0 Det.sg 1] * N.$0 : sg>)"])
 
 with test('step 2; edges'):
     p.step()
@@ -277,7 +381,7 @@ with test('todo'):
 with test('shift; todo'):
     p.shift(2)
     test.eq([repr(spec) for spec in p.todo],
-            ["('node', N.sg, 'dog', 1, 2)"])
+            ["NodeItem(N.sg, 'dog', 1, 2)"])
 
 with test('step 3; chart'):
     p.step()
@@ -288,12 +392,12 @@ with test('node.expansions'): test.eq(str(node.expansions), "['dog']")
 
 with test('todo'):
     test.eq([repr(spec) for spec in p.todo],
-            ["('edge', <Edge NP.$0 -> [0 Det.sg 1] [1 N.sg 2] * : sg>)"])
+            ["EdgeItem(<Edge NP.$0 -> [0 Det.sg 1] [1 N.sg 2] * : sg>)"])
 
 with test('step 4; todo'):
     p.step()
     test.eq([repr(spec) for spec in p.todo],
-            ["('node', NP.sg, [<Node Det.sg 0 1>, <Node N.sg 1 2>], 0, 2)"])
+            ["NodeItem(NP.sg, [<Node Det.sg 0 1>, <Node N.sg 1 2>], 0, 2)"])
 
 with test('step 5; chart'):
     p.step()
@@ -305,7 +409,7 @@ with test('node.expansions'):
 
 with test('todo'):
     test.eq([repr(spec) for spec in p.todo],
-            ["('edge', <Edge S -> [0 NP.sg 2] * VP.$0 : sg>)"])
+            ["EdgeItem(<Edge S -> [0 NP.sg 2] * VP.$0 : sg>)"])
 
 with test('step 6; edges'):
     p.step()
@@ -361,6 +465,538 @@ with open(fg1 + '.sents') as f:
             trees = p(line.split())
             test.eq(len(trees), 1)
 
+with test('parse_many'):
+    with open(fg1 + '.sents') as f:
+        sents = f.read().splitlines()
+    results = list(p.parse_many(sents, workers=2))
+    test.eq([len(trees) for trees in results], [1] * len(sents))
+
+with test('parse_many order'):
+    test.eq([parser.data_structs.terminal_string(trees[0]) for trees in results],
+            [' '.join(s.split()) for s in sents])
+
+with test('parse_many in process'):
+    test.eq([len(trees) for trees in p.parse_many(sents[:3], workers=1)], [1, 1, 1])
+
+with test('concurrent calls'):
+    from concurrent.futures import ThreadPoolExecutor
+    sents = sents * 4
+    with ThreadPoolExecutor(4) as pool:
+        counts = list(pool.map(lambda s: len(p(s.split())), sents))
+    test.eq(counts, [1] * len(sents))
+
+with test('aparse'):
+    import asyncio
+    async def parse_all():
+        return await asyncio.gather(*[p.aparse(s.split()) for s in sents])
+    test.eq([len(trees) for trees in asyncio.run(parse_all())], [1] * len(sents))
+
+coord = ' and '.join(['Jack kills Tuna'] * 4).split()
+
+with test('iterparse'):
+    it = p.iterparse(coord)
+    test.eq(next(it).cat, ('Start',))
+
+with test('iterparse'):
+    test.eq(len(list(it)), 4)
+
+with test('iterparse limit'):
+    test.eq(len(list(p.iterparse(coord, limit=2))), 2)
+
+with test('call limit'):
+    test.eq(len(p(coord, limit=3)), 3)
+
+with test('iterparse no parse'):
+    test.eq(list(p.iterparse('dog Jack the'.split())), [])
+
+with test('count'):
+    test.eq(p.count(coord), 5)
+
+with test('count no parse'):
+    test.eq(p.count('dog Jack the'.split()), 0)
+
+with test('count big'):
+    long_coord = ' and '.join(['Jack kills Tuna'] * 16).split()
+    test.eq(p.count(long_coord), 9694845)
+
+with test('node.count'):
+    node = p.parse(coord)
+    test.eq(node.count(), len(node.trees()))
+
+with test('left corners'):
+    test.eq(sorted(g1.lc['PP']), ['P', 'PP'])
+    test.eq('Det' in g1.lc['Start'], True)
+
+with test('pruning'):
+    unpruned = parser.Parser(g1, prune=False)
+    for s in sents[:len(sents) // 4] + [' '.join(coord)]:
+        test.eq(p.count(s.split()), unpruned.count(s.split()))
+
+with test('pruning chart size'):
+    c = parser.Chart(p, sents[0].split())
+    c.run()
+    c0 = parser.Chart(unpruned, sents[0].split())
+    c0.run()
+    test.eq(len(c.chart) < len(c0.chart), True)
+
+with test('agendas'):
+    for name in ('stack', 'fifo', 'span', 'score'):
+        pa = parser.Parser(g1, agenda=name)
+        test.eq([pa.count(s.split()) for s in sents[:15] + [' '.join(coord)]],
+                [1] * 15 + [5])
+
+with test('priority agenda'):
+    agenda = parser.span_agenda()
+    for item in (parser.NodeItem(C('NP'), 'x', 0, 3), parser.NodeItem(C('N'), 'y', 2, 3),
+                 parser.NodeItem(C('V'), 'z', 1, 2)):
+        agenda.push(item)
+    test.eq([agenda.pop().cat for x in range(len(agenda))], [C('N'), C('V'), C('NP')])
+
+with test('priority agenda pickle'):
+    import pickle
+    for name in ('span', 'score'):
+        pp = pickle.loads(pickle.dumps(parser.Parser(g1, agenda=name)))
+        test.eq(pp.count(coord), 5)
+
+with test('first parse'):
+    pf = parser.Parser(g1, first=True, stats=True)
+    node = pf.parse(coord)
+    test.eq(node.count() >= 1, True)
+    pn = parser.Parser(g1, stats=True)
+    pn.parse(coord)
+    test.eq(pf.stats.edges < pn.stats.edges, True)
+    test.eq(pf.stats.nodes < pn.stats.nodes, True)
+
+with test('feed'):
+    inc = p.incremental()
+    test.eq([inc.feed(w) for w in 'West is an American'.split()],
+            [True, False, False, True])
+
+with test('feed trees'):
+    test.eq([str(t.cat) for t in inc.trees()], ['Start'])
+    test.eq(inc.words, 'West is an American'.split())
+
+with test('partial_state'):
+    test.eq(inc.feed('who'), False)
+    test.eq(sorted(str(e.afterdot()) for e in inc.partial_state()),
+            ['NP.$0', 'VP.$0.-'])
+
+with test('feed matches parse'):
+    inc = parser.Parser(g1.compile()).incremental()
+    for w in coord:
+        done = inc.feed(w)
+    test.eq((done, inc.root().count()), (True, 5))
+
+with test('prefix cache'):
+    pp = parser.Parser(g1, prefix_cache=True, stats=True)
+    pp('every cat is an animal'.split())
+    test.eq(pp.stats.calls['shift'], 5)
+
+with test('prefix cache resume'):
+    test.eq(pp.count('every cat is a cat'.split()), 1)
+    test.eq(pp.stats.calls['shift'], 3)
+
+with test('prefix cache results'):
+    for s in sents[:15] + [' '.join(coord)]:
+        for k in range(1, len(s.split()) + 1):
+            test.eq(pp.count(s.split()[:k]), p.count(s.split()[:k]))
+
+with test('prefix cache eviction'):
+    cache = parser.PrefixCache(max_entries=2)
+    pe = parser.Parser(g1, prefix_cache=cache)
+    for s in sents[:3]:
+        pe(s.split())
+    test.eq(len(cache.charts), 2)
+    # sents[2] resumed from sents[0], so sents[1] was least recently used
+    test.eq(tuple(sents[1].split()[:1]) in cache.prefixes, False)
+    test.eq(tuple(sents[0].split()[:2]) in cache.prefixes, True)
+
+with test('prefix cache rejected'):
+    # a sentence turned down for an unknown word leaves no prefix behind
+    pz = parser.Parser(g1, prefix_cache=True)
+    test.eq(pz.count('Jack loves all zzz'.split()), 0)
+    test.eq((len(pz.prefix_cache.charts), pz.count('Jack loves all animals'.split())),
+            (0, 1))
+
+with test('prefix cache bytes'):
+    cache = parser.PrefixCache(max_entries=None, max_bytes=1)
+    parser.Parser(g1, prefix_cache=cache)(sents[0].split())
+    test.eq((len(cache.charts), cache.charts.bytes, cache.prefixes), (0, 0, {}))
+
+with test('result cache'):
+    gr = parser.Grammar(fg1)
+    pr = parser.Parser(gr, result_cache=True)
+    chart = pr.fill(coord)
+    test.eq(pr.fill(list(coord)) is chart, True)
+    test.eq((pr.result_cache.hits, pr.result_cache.misses), (1, 1))
+
+with test('result cache trees'):
+    test.eq(len(pr(coord)), 5)
+    test.eq(pr.count(coord), 5)
+    test.eq(pr.result_cache.hits, 3)
+
+with test('result cache invalidation'):
+    gr.load()
+    test.eq(pr.fill(coord) is chart, False)
+    test.eq(len(pr.result_cache.charts), 1)
+
+with test('compiled grammar reload'):
+    tmpdir = tempfile.mkdtemp()
+    for ext in ('.g', '.lex'):
+        shutil.copy(fg0 + ext, os.path.join(tmpdir, 'fg0' + ext))
+    tmp_fg0 = os.path.join(tmpdir, 'fg0')
+    gl = parser.Grammar(tmp_fg0)
+    cgl = gl.compile()
+    words = 'these dogs bark loudly'.split()
+    pls = [parser.Parser(cgl), parser.Parser(cgl, result_cache=True, prefix_cache=True),
+           parser.Parser(cgl, engine='cky')]
+    test.eq([pl.count(words) for pl in pls], [0, 0, 0])
+    with open(tmp_fg0 + '.g', 'a') as f:
+        f.write('VP.$f -> VP.$f Adv\n')
+    with open(tmp_fg0 + '.lex', 'a') as f:
+        f.write('loudly Adv\n')
+    gl.load()
+    test.eq([pl.count(words) for pl in pls], [1, 1, 1])
+    test.eq(cgl.version, gl.version)
+    shutil.rmtree(tmpdir)
+
+with test('result cache stats'):
+    seen = []
+    pr = parser.Parser(gr, result_cache=True, on_stats=seen.append)
+    pr.fill(coord)
+    pr.fill(sents[0].split())
+    test.eq([(st.words, st.cache_hit, st.nodes > 0) for st in seen],
+            [(len(coord), False, True), (13, False, True)])
+    pr.fill(coord)
+    test.eq((pr.stats is seen[-1], pr.stats.words, pr.stats.cache_hit, pr.stats.nodes),
+            (True, len(coord), True, 0))
+
+with test('result cache shared'):
+    shared = parser.ResultCache()
+    full = parser.Parser(gr, result_cache=shared).fill(coord)
+    first = parser.Parser(gr, result_cache=shared, first=True).fill(coord)
+    test.eq((first is full, full.root().count(), len(shared.charts)), (False, 5, 2))
+    test.eq(parser.Parser(gr, result_cache=shared).fill(coord) is full, True)
+
+with test('result cache bytes'):
+    pr = parser.Parser(gr, result_cache=parser.ResultCache(max_bytes=chart.size() * 2))
+    for s in sents[:4]:
+        pr(s.split())
+    test.eq(pr.result_cache.charts.bytes <= chart.size() * 2, True)
+
+with test('lru policy'):
+    lru = parser.LRUCache(max_entries=2)
+    lru.put('a', 1); lru.put('b', 2); lru.get('a'); lru.put('c', 3)
+    fifo = parser.LRUCache(max_entries=2, policy='fifo')
+    fifo.put('a', 1); fifo.put('b', 2); fifo.get('a'); fifo.put('c', 3)
+    test.eq((sorted(lru.entries), sorted(fifo.entries)), (['a', 'c'], ['b', 'c']))
+
+with test('stats'):
+    seen = []
+    ps = parser.Parser(g1, stats=True, on_stats=seen.append)
+    ps(sents[0].split())
+    st = ps.stats
+    test.eq((st.words, st.calls['shift'], seen), (13, 13, [st]))
+
+with test('stats counters'):
+    test.eq(st.nodes, st.calls['start'])
+    test.eq(st.unify_successes <= st.unify_attempts, True)
+    test.eq(st.agenda_max > 0 and st.total_time > 0, True)
+    test.eq(sum(st.rules.values()), st.edges)
+
+with test('stats duplicates'):
+    ps(coord)
+    test.eq(ps.stats.duplicates, 0)
+    test.eq(ps.stats.as_dict()['calls']['complete'] > 0, True)
+
+with test('no stats'):
+    test.eq(p.stats, None)
+
+with test('kbest unweighted'):
+    best = p.kbest(coord, 10)
+    test.eq([score for (score, t) in best], [0.0] * 5)
+
+with test('load weighted grammar'):
+    g2 = parser.Grammar(fg2)
+    p2 = parser.Parser(g2)
+    test.eq([r.score for r in g2.expansions('VP')], [0.0, -0.5])
+
+with test('lexicon score'):
+    test.eq(g2.lexicon.score('saw', C('N')), -2.0)
+    test.eq(g2.lexicon.parts('saw'), [C('V'), C('N')])
+
+with test('kbest'):
+    best = p2.kbest('I saw the man with a telescope'.split(), 3)
+    test.eq([round(score, 6) for (score, t) in best], [-0.6, -1.1])
+
+with test('kbest'):
+    test.tree(best[0][1], [('S',),
+                           [('NP',), 'I'],
+                           [('VP',),
+                            [('VP',),
+                             [('V',), 'saw'],
+                             [('NP',), [('Det',), 'the'], [('N',), 'man']]],
+                            [('PP',),
+                             [('P',), 'with'],
+                             [('NP',), [('Det',), 'a'], [('N',), 'telescope']]]]])
+
+with test('compile'):
+    cg1 = g1.compile()
+    test.eq(cg1.decode(cg1.start), C('Start'))
+
+with test('compiled categories'):
+    test.eq(all(isinstance(f, int) for f in cg1.encode(C('V.sg.t.*'))), True)
+    test.eq(cg1.encode(C('NP.*'))[1], parser.STAR)
+
+with test('compiled continuations'):
+    aux = cg1.symbols.intern('Aux')
+    test.eq(sorted(repr(r) for r in cg1.continuations(aux)),
+            sorted(repr(r) for r in g1.continuations('Aux')))
+
+with test('compiled unify'):
+    src = C('V.$f.i.$p', {})
+    x = cg1.encode(src)
+    plan = parser.make_plan(src, x, parser.STAR)
+    b1 = parser.unify_plan(plan, cg1.encode(C('V.sg.i.*')), (parser.STAR,) * 2)
+    test.eq(cg1.decode(parser.instantiate(x, parser.make_slots(src), b1)), C('V.sg.i.*'))
+
+with test('compiled parser'):
+    pc = parser.Parser(cg1)
+    with open(fg1 + '.sents') as f:
+        for line in f:
+            test.eq([str(t.cat) for t in pc(line.split())], ['Start'])
+
+with test('compiled parser trees'):
+    ts = pc('Jack loves all animals'.split())
+    test.eq(ts[0].children[0].cat, C('Root'))
+    test.eq(pc.count(coord), 5)
+
+with test('compiled kbest'):
+    best = parser.Parser(g2.compile()).kbest('I saw the man with a telescope'.split(), 3)
+    test.eq([round(score, 6) for (score, t) in best], [-0.6, -1.1])
+
+with test('best first'):
+    pb = parser.Parser(g2, agenda='score', first=True)
+    (score, tree) = pb.kbest('I saw the man with a telescope'.split(), 1)[0]
+    test.eq(round(score, 6), -0.6)
+    test.tree(tree, [('S',),
+                           [('NP',), 'I'],
+                           [('VP',),
+                            [('VP',),
+                             [('V',), 'saw'],
+                             [('NP',), [('Det',), 'the'], [('N',), 'man']]],
+                            [('PP',),
+                             [('P',), 'with'],
+                             [('NP',), [('Det',), 'a'], [('N',), 'telescope']]]]])
+
+with test('kbest k=1'):
+    test.eq(len(p2.kbest('I saw the man with a telescope'.split(), 1)), 1)
+
+with test('mapped lexicon'):
+    lexdir = tempfile.mkdtemp()
+    lexmap = os.path.join(lexdir, 'fg1.lexmap')
+    parser.write_mapped_lexicon(g1.lexicon, lexmap)
+    ml = parser.MappedLexicon(lexmap)
+    for word in ['Jack', 'loves', 'animals', 'nonword']:
+        test.eq(ml.parts(word), g1.lexicon.parts(word))
+    test.eq(sorted(ml.words('V')), sorted(g1.lexicon.words('V')))
+    test.eq(ml.unknown(['Jack', 'nonword']), ['nonword'])
+
+with test('mapped lexicon scores'):
+    lexmap2 = os.path.join(lexdir, 'fg2.lexmap')
+    parser.write_mapped_lexicon(g2.lexicon, lexmap2)
+    ml2 = parser.MappedLexicon(lexmap2)
+    for cat in g2.lexicon.parts('saw'):
+        test.eq(ml2.score('saw', cat), g2.lexicon.score('saw', cat))
+
+with test('mapped lexicon grammar'):
+    gm = parser.Grammar(fg1, lexicon=lexmap)
+    pm = parser.Parser(gm)
+    test.eq(pm.count(coord), p.count(coord))
+    pcm = parser.Parser(gm.compile())
+    test.eq(pcm.count(coord), p.count(coord))
+
+with test('mapped lexicon pickle'):
+    import pickle
+    with pickle.loads(pickle.dumps(ml)) as mp:
+        test.eq(mp.parts('Jack'), ml.parts('Jack'))
+
+with test('mapped lexicon close'):
+    with parser.MappedLexicon(lexmap) as mc:
+        test.eq(mc.known('Jack'), True)
+    test.eq((mc.map.closed, mc.file.closed), (True, True))
+    # no fallback tables: unknown words have no parts
+    test.eq((hasattr(ml, 'add_fallbacks'), ml.parts('Jacks')), (False, []))
+    for lexicon in (ml, ml2, gm.lexicon):
+        lexicon.close()
+    shutil.rmtree(lexdir)
+
+with test('benchmark smoke run'):
+    import bench, io, json
+    results = bench.run(quick=True)
+    test.eq(sorted(results['throughput']), ['cky', 'compiled', 'compiled_cky', 'plain'])
+    test.eq([row['trees'] for row in results['scaling']['plain']['pp_attachment']],
+            [1, 2, 5])
+    bench.report(json.loads(json.dumps(results)), io.StringIO())
+
+with test('benchmark percentiles'):
+    test.eq([bench.percentile(range(1, 11), p) for p in (10, 50, 90, 99, 100)],
+            [1, 5, 9, 10, 10])
+    test.eq([bench.percentile(range(1, 101), p) for p in (1, 50, 99)], [1, 50, 99])
+    test.eq((bench.percentile([7], 50), bench.percentile([], 50)), (7, None))
+
+with test('binarized rules'):
+    rule = g1.expansions('VP')[6]
+    split = parser.Split(rule, 1)
+    test.eq((repr(rule), split.head, split.next.head, split.next.next),
+            ('VP.$0.- -> V.$0.t.$1 NP.* PP.$1', 'NP', 'PP', None))
+
+with test('cky parser'):
+    for grammar in (g1, cg1):
+        pa = parser.Parser(grammar)
+        pk = parser.Parser(grammar, engine='cky')
+        with open(fg1 + '.sents') as f:
+            for line in f:
+                test.eq(sorted(str(t) for t in pk(line.split())),
+                        sorted(str(t) for t in pa(line.split())))
+
+with test('cky counts'):
+    pk = parser.Parser(g1, engine='cky')
+    test.eq(pk.count(coord), 5)
+    test.eq(pk.count(('Jack loves the dog' + ' behind the dog' * 4).split()), 14)
+    test.eq(parser.Parser(g1, engine='cky', prune=False).count(coord), 5)
+
+with test('cky kbest'):
+    best = parser.Parser(g2, engine='cky').kbest('I saw the man with a telescope'.split(), 3)
+    test.eq([round(score, 6) for (score, t) in best], [-0.6, -1.1])
+
+with test('cky incremental'):
+    chart = parser.Parser(g1, engine='cky').incremental()
+    test.eq([chart.feed(w) for w in 'Jack loves all animals'.split()],
+            [True, False, False, True])
+
+with test('cky partial_state'):
+    states = []
+    for engine in ('agenda', 'cky'):
+        chart = parser.Parser(g1, engine=engine).incremental()
+        for w in 'West is an American who'.split():
+            chart.feed(w)
+        test.eq(sorted(str(e.afterdot()) for e in chart.partial_state()),
+                ['NP.$0', 'VP.$0.-'])
+        states.append(sorted(str(e) for e in chart.partial_state()))
+    test.eq(states[1], states[0])
+
+with test('cky stats rejected'):
+    try:
+        parser.Parser(g1, engine='cky', stats=True)
+        exception = False
+    except AssertionError:
+        exception = True
+    test.eq(exception, True)
+
+with test('cky prefix cache'):
+    pk = parser.Parser(g1, engine='cky', prefix_cache=True)
+    test.eq([pk.count(s) for s in (coord, coord[:7], coord + ['and', 'Jack', 'kills', 'Tuna'])],
+            [5, 1, 14])
+
+with test('cky prefix cache rejected'):
+    pz = parser.Parser(g1, engine='cky', prefix_cache=True)
+    test.eq(pz.count('Jack loves all zzz'.split()), 0)
+    test.eq((len(pz.prefix_cache.charts), pz.count('Jack loves all animals'.split())),
+            (0, 1))
+
+with test('feature index'):
+    index = parser.FeatureIndex('*')
+    index.add('a', 3, ((1, 'sg'),))
+    index.add('b', 3, ())
+    index.add('c', 3, ((1, 'pl'), (2, 't')))
+    index.add('d', 2, ())
+    test.eq(index.candidates(C('X.sg.t')), ['a', 'b'])
+    test.eq(index.candidates(C('X.*.t')), ['a', 'b', 'c'])
+    test.eq(index.candidates(C('X.pl.i')), ['b'])
+    test.eq(index.candidates(C('X.pl')), ['d'])
+
+with test('indexed rule starts'):
+    for grammar in (g1, cg1):
+        for word in ('loves', 'is', 'the', 'Jack'):
+            for cat in grammar.lexicon.parts(word):
+                head = cat[0]
+                test.eq(grammar.starts(cat),
+                        [r for r in grammar.continuations(head)
+                         if parser.unify_plan(r.plans[0], cat, r.bindings) is not None])
+    v = cg1.encode(C('V.sg.t.np'))
+    test.eq((len(cg1.continuations(v[0])), len(cg1.starts(v))), (10, 5))
+
+with test('indexed waiting edges'):
+    saved = parser.INDEX_MIN_EDGES
+    parser.INDEX_MIN_EDGES = 1
+    try:
+        for grammar in (g1, cg1):
+            pi = parser.Parser(grammar)
+            with open(fg1 + '.sents') as f:
+                for line in f:
+                    test.eq(sorted(str(t) for t in pi(line.split())),
+                            sorted(str(t) for t in p(line.split())))
+            test.eq(pi.count(coord), 5)
+    finally:
+        parser.INDEX_MIN_EDGES = saved
+
+with test('merged edges'):
+    # S -> X X . Z is reached twice over 'a a a': (a)(a a) and (a a)(a)
+    tmp_g = os.path.join(tempfile.mkdtemp(), 'split')
+    with open(tmp_g + '.g', 'w') as f:
+        f.write('S -> X X Z\nX -> A\nX -> A A\n')
+    with open(tmp_g + '.lex', 'w') as f:
+        f.write('a A\nz Z\n')
+    pm = parser.Parser(parser.Grammar(tmp_g), stats=True)
+    words = 'a a a z'.split()
+    test.eq(sorted(str(t) for t in pm(words)),
+            sorted(str(t) for t in parser.Parser(parser.Grammar(tmp_g), engine='cky')(words)))
+    test.eq((pm.count(words), pm.stats.merged_edges, pm.stats.duplicates), (2, 1, 0))
+    mc = pm.new_chart(words)
+    mc.run()
+    (waiting,) = mc.edges[3, 'Z']
+    test.eq(len(waiting.expansions()), 2)
+    test.eq(waiting.expansion, waiting.expansions()[0])
+    shutil.rmtree(os.path.dirname(tmp_g))
+
+with test('packed nodes'):
+    # NP.* and NP.sg both span 'the fish'; only S -> NP.$n VP.$n tells
+    # them apart
+    tmp_g = os.path.join(tempfile.mkdtemp(), 'pack')
+    with open(tmp_g + '.g', 'w') as f:
+        f.write('S -> NP.* VP.*\nS -> NP.$n VP.$n\nNP.$n -> Det.$n N.$n\n'
+                'NP.sg -> Det.* N.*\nVP.$n -> V.$n\nVP.$n -> V.$n NP.*\n')
+    with open(tmp_g + '.lex', 'w') as f:
+        f.write('the Det.*\nfish N.*\nswims V.sg\nsees V.sg\n')
+    gp = parser.Grammar(tmp_g)
+    words = 'the fish sees the fish'.split()
+    for grammar in (gp, gp.compile()):
+        for agenda in ('stack', 'fifo'):
+            pp = parser.Parser(grammar, pack=True, stats=True, agenda=agenda)
+            pu = parser.Parser(grammar, stats=True, agenda=agenda)
+            test.eq(sorted(str(t) for t in pp(words)), sorted(str(t) for t in pu(words)))
+            test.eq(pp.stats.packed_nodes, 2)
+            test.eq(pp.stats.unify_attempts < pu.stats.unify_attempts, True)
+            test.eq([score for (score, t) in pp.kbest(words, 5)],
+                    [score for (score, t) in pu.kbest(words, 5)])
+    shutil.rmtree(os.path.dirname(tmp_g))
+
+with test('care positions'):
+    rule = gp.expansions('S')[0]
+    test.eq([parser.care_positions(gp, rule, dot) for dot in (0, 1)],
+            [frozenset(), frozenset()])
+    rule = gp.expansions('S')[1]
+    test.eq(parser.care_positions(gp, rule, 0), frozenset([1]))
+
+with test('packing on fg1'):
+    pp = parser.Parser(g1, pack=True)
+    with open(fg1 + '.sents') as f:
+        for line in f:
+            test.eq(sorted(str(t) for t in pp(line.split())),
+                    sorted(str(t) for t in p(line.split())))
+    test.eq(pp.count(coord), 5)
+
 
 #--  End  ----------------------------------------------------------------------
 